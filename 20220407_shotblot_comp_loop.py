@@ -19,7 +19,7 @@ pd.set_option('display.max_columns', 20)
 pd.set_option('display.width', desired_width)
 
 shots_df = utils.load_shots_df()
-ref_gdf = utils.calc_shot_dist_profile(shots_df, "NBA")
+ref_gdf = utils.get_ref_shot_dist_profile(shots_df, persist=True)
 gdf = utils.get_shot_dist_df(shots_df)
 
 # FILTER GAMES FOR THE LATEST DAY
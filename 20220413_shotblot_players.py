@@ -22,7 +22,7 @@ pd.set_option('display.width', desired_width)
 shots_df = utils.load_shots_df()
 
 # =========== DETERMINE REFERENCE (NBA-AVERGE) SHOT PROFILE ==========
-ref_gdf = utils.calc_shot_dist_profile(shots_df, "NBA")
+ref_gdf = utils.get_ref_shot_dist_profile(shots_df, persist=True)
 
 # =========== DETERMINE SHOT PROFILES FOR EACH TEAM ==========
 gdf = utils.get_shot_dist_df(shots_df)
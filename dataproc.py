@@ -7,6 +7,8 @@ import numpy as np
 # ===== START LOGGER =====
 logger = logging.getLogger(__name__)
 
+oncourt_cols = ['a1', 'a2', 'a3', 'a4', 'a5', 'h1', 'h2', 'h3', 'h4', 'h5']  # On-court player name columns
+
 
 def load_log_df(logpath):
 
@@ -84,91 +86,212 @@ def flip_x_coords(log_df):
     return log_df
 
 
-def filter_error_rows(log_df, filt_cols=('original_x', 'original_y', 'shot_distance')):
-
-    logger.info(f"Filtering {len(log_df)} rows")
-    log_df = log_df[(log_df["original_y"].notna()) & (log_df["original_x"].notna()) & (log_df["shot_distance"].notna())]
-    logger.info(f"{len(log_df)} rows remaining after filtering NA values")
-
-    for filt_col in filt_cols:
-        logger.info(f"Processing {filt_col}")
-
-        log_df[filt_col] = log_df[filt_col].astype(str)
-        log_df = log_df[-log_df[filt_col].str.contains(r"[^0-9./-]", regex=True)]
-        log_df[filt_col] = log_df[filt_col].astype(float)
-
-        logger.info(f"{len(log_df)} rows remaining after filtering string values with {filt_col}")
-
+def filter_error_rows(log_df, filt_cols=('original_x', 'original_y', 'shot_distance'), return_stats=False):
+    """
+    Drop rows with missing or non-numeric shot locations, and convert filt_cols to floats
+    :param log_df: Log DataFrame
+    :param filt_cols: Columns to parse as numbers - rows where any of these cannot be parsed are dropped
+    :param return_stats: Also return a dict of filtering stats:
+        rows_in, na_rows (rows dropped for NA locations), invalid_by_col (unparseable values by column), rows_out
+    :return: Filtered DataFrame (and stats dict if return_stats)
+    """
+    filt_cols = list(filt_cols)
+    stats = {"rows_in": len(log_df)}
+
+    na_mask = (log_df["original_y"].isna()) | (log_df["original_x"].isna()) | (log_df["shot_distance"].isna())
+    stats["na_rows"] = int(na_mask.sum())
+    log_df = log_df[~na_mask]
+
+    parsed_df = log_df[filt_cols].apply(pd.to_numeric, errors="coerce").astype(float)
+    invalid_df = ~np.isfinite(parsed_df)
+    stats["invalid_by_col"] = {col: int(n) for col, n in invalid_df.sum().items()}
+    valid_mask = ~invalid_df.any(axis=1).values
+    log_df = log_df[valid_mask].assign(**{col: parsed_df[col].values[valid_mask] for col in filt_cols})
+    stats["rows_out"] = len(log_df)
+
+    logger.info(f"Filtered {stats['rows_in']} rows to {stats['rows_out']}: {stats}")
+    if return_stats:
+        return log_df, stats
     return log_df
 
 
-def filter_oncourt_pl(in_df, playername, playeron=True, exclude_player=True):
-
-    oncourt_names = (
-            in_df['a1'] + in_df['a2'] + in_df['a3'] + in_df['a4'] + in_df['a5']
-            + in_df['h1'] + in_df['h2'] + in_df['h3'] + in_df['h4'] + in_df['h5']
-    )
-    # in_df['oncourt'] = oncourt_names
-    in_df = in_df.assign(oncourt=oncourt_names)
+class LineupIndex:
+    """
+    Integer-ID representation of the players on court for each row (e.g. shot) of a DataFrame.
+    Player names are factorized into IDs, and each row's player set is stored as a bitmask (uint64 words).
+    Distinct bitmasks are interned into a lineup table, so that on/off filters are tested once per lineup
+    and then broadcast to rows via lineup_idx - which can also be used as a key for lineup-level aggregations.
+    """
+    def __init__(self, players, lineups, lineup_idx):
+        self.players = players  # Player names, by player ID
+        self.player_ids = {pl: i for i, pl in enumerate(players)}
+        self.lineups = lineups  # (n_lineups, n_words) bitmasks
+        self.lineup_idx = lineup_idx  # Lineup table index for each row
+
+    @classmethod
+    def from_df(cls, in_df, player_cols=oncourt_cols):
+        """
+        Build a lineup index from on-court player columns
+        :param in_df: DataFrame, e.g. shots_df
+        :param player_cols: Columns holding player names (or IDs); empty/NA values are ignored
+        :return: LineupIndex
+        """
+        pl_vals = in_df[list(player_cols)].replace("", np.nan).values
+        pl_codes, players = pd.factorize(pl_vals.ravel())
+        pl_codes = pl_codes.reshape(pl_vals.shape)
+
+        n_words = max(1, -(-len(players) // 64))
+        masks = np.zeros((len(in_df), n_words), dtype=np.uint64)
+        rows = np.arange(len(in_df))
+        for j in range(pl_codes.shape[1]):
+            has_pl = pl_codes[:, j] >= 0
+            codes = pl_codes[has_pl, j]
+            masks[rows[has_pl], codes // 64] |= np.left_shift(np.uint64(1), (codes % 64).astype(np.uint64))
+
+        # Intern the distinct bitmasks - unique over a bytes view of each row is much faster than np.unique(axis=0)
+        mask_bytes = masks.view(np.dtype((np.void, masks.itemsize * n_words))).ravel()
+        lineup_bytes, lineup_idx = np.unique(mask_bytes, return_inverse=True)
+        lineups = lineup_bytes.view(np.uint64).reshape(-1, n_words)
+        return cls(np.asarray(players), lineups, lineup_idx.ravel())
+
+    @property
+    def n_players(self):
+        return len(self.players)
+
+    @property
+    def n_lineups(self):
+        return len(self.lineups)
+
+    def get_players_mask(self, playernames):
+        """
+        Bitmask of a set of players
+        :param playernames: List of player names; names not in the index are skipped
+        :return: Tuple - (bitmask array of n_words, number of players not found)
+        """
+        mask = np.zeros(self.lineups.shape[1], dtype=np.uint64)
+        n_missing = 0
+        for pl in playernames:
+            pl_id = self.player_ids.get(pl)
+            if pl_id is None:
+                n_missing += 1
+                continue
+            mask[pl_id // 64] |= np.uint64(1) << np.uint64(pl_id % 64)
+        return mask, n_missing
+
+    def get_lineup_filter(self, on_players=None, off_players=None):
+        """
+        Boolean filter of lineups that include all of on_players and none of off_players
+        :param on_players: List of player names that must be on court
+        :param off_players: List of player names that must be off court
+        :return: Boolean array, one element per lineup
+        """
+        lineup_filter = np.ones(self.n_lineups, dtype=bool)
+        if on_players:
+            on_mask, n_missing = self.get_players_mask(on_players)
+            if n_missing > 0:
+                return np.zeros(self.n_lineups, dtype=bool)
+            lineup_filter &= ((self.lineups & on_mask) == on_mask).all(axis=1)
+        if off_players:
+            off_mask, _ = self.get_players_mask(off_players)
+            lineup_filter &= ((self.lineups & off_mask) == 0).all(axis=1)
+        return lineup_filter
+
+    def get_row_filter(self, on_players=None, off_players=None):
+        """
+        Boolean filter of rows where all of on_players and none of off_players are on court
+        :param on_players: List of player names that must be on court
+        :param off_players: List of player names that must be off court
+        :return: Boolean array, one element per row
+        """
+        return self.get_lineup_filter(on_players, off_players)[self.lineup_idx]
+
+    def get_lineup_players(self, lineup_id):
+        """
+        Players in a lineup
+        :param lineup_id: Index into the lineup table
+        :return: Sorted list of player names
+        """
+        words = self.lineups[lineup_id]
+        bits = np.unpackbits(words.astype('<u8').view(np.uint8), bitorder='little')
+        return sorted(self.players[np.flatnonzero(bits)[:self.n_players]].tolist())
+
+
+def filter_oncourt_pl(in_df, playername, playeron=True, exclude_player=True, lineup_index=None):
+    """
+    Filter rows by whether a player is on court
+    :param in_df: DataFrame with on-court player columns (see oncourt_cols)
+    :param playername: Player name
+    :param playeron: True to keep rows with the player on court; False for off court
+    :param exclude_player: Exclude rows where the player is the shooter
+    :param lineup_index: Prebuilt LineupIndex for in_df (built if None)
+    :return: Filtered DataFrame
+    """
+    if lineup_index is None:
+        lineup_index = LineupIndex.from_df(in_df)
 
-    player_filter = in_df.oncourt.str.contains(playername)
     if playeron is False:
-        player_filter = -player_filter
+        player_filter = lineup_index.get_row_filter(off_players=[playername])
+    else:
+        player_filter = lineup_index.get_row_filter(on_players=[playername])
 
     in_df = in_df[player_filter]
 
-    in_df = in_df.drop(labels='oncourt', axis=1)
-
     if exclude_player:
         in_df = in_df[in_df['player'] != playername]
 
     return in_df
 
 
-def get_zones(x, y, excl_angle=False):
+def get_zone_arrays(x, y):
+    """
+    Classify shot locations into court zones
+    :param x: x coordinates (array-like)
+    :param y: y coordinates (array-like)
+    :return: Tuple of categoricals - (zones incl. left/middle/right, zones without angle)
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
 
-    def append_name_by_angle(temp_angle):
+    angles = np.arctan2(y, x) / np.pi * 180
+    dists = ((x ** 2 + y ** 2) ** 0.5) / 10
 
-        if excl_angle:
-            temp_text = ''
-        else:
-            if temp_angle < 60 and temp_angle >= -90:
-                temp_text = '_right'
-            elif temp_angle < 120 and temp_angle >= 60:
-                temp_text = '_middle'
-            else:
-                temp_text = '_left'
-        return temp_text
-
-    import math
-
-    zones_list = list()
-    for i in range(len(x)):
-
-        temp_angle = math.atan2(y[i], x[i]) / math.pi * 180
-        temp_dist = ((x[i] ** 2 + y[i] ** 2) ** 0.5) / 10
-
-        if temp_dist > 30:
-            zone = '7 - 30+ ft'
-        elif (x[i] < -220 or x[i] > 220) and y[i] < 90:
-            zone = '4 - Corner 3s'
-            zone += append_name_by_angle(temp_angle)
-        elif temp_dist > 27:
-            zone = '6 - Long 3s'
-            zone += append_name_by_angle(temp_angle)
-        elif temp_dist > 23.75:
-            zone = '5 - Short 3 (<27 ft)'
-            zone += append_name_by_angle(temp_angle)
-        elif temp_dist > 14:
-            zone = '3 - Long 2 (14+ ft)'
-            zone += append_name_by_angle(temp_angle)
-        elif temp_dist > 4:
-            zone = '2 - Short 2 (4-14 ft)'
-            zone += append_name_by_angle(temp_angle)
-        else:
-            zone = '1 - Within 4 ft'
+    # Zones in order of precedence - (label, whether split by angle)
+    zone_defs = [
+        ('7 - 30+ ft', False), ('4 - Corner 3s', True), ('6 - Long 3s', True), ('5 - Short 3 (<27 ft)', True),
+        ('3 - Long 2 (14+ ft)', True), ('2 - Short 2 (4-14 ft)', True), ('1 - Within 4 ft', False)
+    ]
+    zone_idx = np.select([
+        dists > 30,
+        ((x < -220) | (x > 220)) & (y < 90),
+        dists > 27,
+        dists > 23.75,
+        dists > 14,
+        dists > 4,
+    ], np.arange(6), default=6)
+    angle_idx = np.select([
+        (angles < 60) & (angles >= -90),
+        (angles < 120) & (angles >= 60),
+    ], [0, 1], default=2)
+    angle_suffixes = ['_right', '_middle', '_left']
+
+    simple_cats = sorted(z for z, _ in zone_defs)
+    simple_codes = np.array([simple_cats.index(z) for z, _ in zone_defs])
+    full_labels = [[z + suffix if by_angle else z for suffix in angle_suffixes] for z, by_angle in zone_defs]
+    full_cats = sorted(set(label for labels in full_labels for label in labels))
+    full_codes = np.array([[full_cats.index(label) for label in labels] for labels in full_labels])
+
+    shot_zones = pd.Categorical.from_codes(full_codes[zone_idx, angle_idx], categories=full_cats)
+    simple_zones = pd.Categorical.from_codes(simple_codes[zone_idx], categories=simple_cats)
+    return shot_zones, simple_zones
 
-        zones_list.append(zone)
+
+def get_zones(x, y, excl_angle=False):
+
+    shot_zones, simple_zones = get_zone_arrays(x, y)
+    if excl_angle:
+        zones_list = list(simple_zones)
+    else:
+        zones_list = list(shot_zones)
 
     return zones_list
 
@@ -204,31 +327,23 @@ def process_shots_df(log_df):
         logger.info('Flipping x_coordinates because they are reversed somehow :(')
         shots_df = flip_x_coords(shots_df)
 
-    shots_df = shots_df.assign(shot_zone=get_zones(list(shots_df['original_x']), list(shots_df['original_y'])))
-    shots_df = shots_df.assign(simple_zone=get_zones(list(shots_df['original_x']), list(shots_df['original_y']), excl_angle=True))
+    shot_zones, simple_zones = get_zone_arrays(shots_df['original_x'].values, shots_df['original_y'].values)
+    shots_df = shots_df.assign(shot_zone=shot_zones, simple_zone=simple_zones)
     shots_df = mark_df_threes(shots_df)
 
     # Set up total time (game time) column & score difference column
-    remaining_time = [i.split(':') for i in list(shots_df['remaining_time'])]
-    tot_time = list()
-    for i in range(len(shots_df)):
-        if shots_df.iloc[i]['period'] < 5:
-            tmp_gametime = ((shots_df.iloc[i]['period'] - 1) * 12) + (11 - int(remaining_time[i][1])) + (1 - (int(remaining_time[i][2]) / 60))
-        else:
-            tmp_gametime = 48.0 + ((shots_df.iloc[i]['period'] - 5) * 5) + (4 - int(remaining_time[i][1])) + (1 - (int(remaining_time[i][2]) / 60))
-        tot_time.append(tmp_gametime)
-    shots_df['tot_time'] = tot_time
+    remaining_time = shots_df['remaining_time'].str.split(':', expand=True)
+    rem_mins = remaining_time[1].astype(int).values
+    rem_secs = remaining_time[2].astype(int).values
+    periods = shots_df['period'].values
+    reg_time = ((periods - 1) * 12) + (11 - rem_mins) + (1 - (rem_secs / 60))
+    ot_time = 48.0 + ((periods - 5) * 5) + (4 - rem_mins) + (1 - (rem_secs / 60))
+    shots_df = shots_df.assign(tot_time=np.where(periods < 5, reg_time, ot_time))
     shots_df = shots_df.assign(score_diff=abs(shots_df.home_score - shots_df.away_score))
 
     # Mark garbage time shots: Rule: up 13 with a minute left, increasing by one each minute
-    garbage_marker = pd.Series([False] * len(shots_df))
-    for i, row in shots_df.iterrows():
-        if (row["period"] == 4):
-            rem_mins = row["remaining_time"].split(":")[1]
-            score_threshold = 13 + int(rem_mins)
-            if row["score_diff"] >= score_threshold:
-                garbage_marker[i] = True
-    shots_df['garbage'] = garbage_marker
+    garbage_marker = (periods == 4) & (shots_df["score_diff"].values >= 13 + rem_mins)
+    shots_df = shots_df.assign(garbage=garbage_marker)
 
     return shots_df
 
@@ -285,8 +400,7 @@ def build_shots_df(logs_df, outfile='procdata/shots_df.csv', sm_df=False, overwr
             'date', 'period', 'away_score', 'home_score', 'remaining_time', 'elapsed', 'team', 'event_type',
             'assist', 'away', 'home', 'block', 'opponent', 'player',
             'shot_distance', 'original_x', 'original_y', 'shot_made', 'is_three', 'shot_zone', 'simple_zone'
-        ]]
-    shots_df = shots_df.assign(on_court=shots_df["a1"] + shots_df["a2"] + shots_df["a3"] + shots_df["a4"] + shots_df["a5"] + shots_df["h1"] + shots_df["h2"] + shots_df["h3"] + shots_df["h4"] + shots_df["h5"])
+        ] + oncourt_cols]
 
     if outfile is not None:
         if overwrite is not True:
@@ -386,8 +500,71 @@ def get_pl_data_dict(time_df, player, team, pl_acc_dict, pl_pps_dict, min_start,
     return temp_dict
 
 
-def build_shot_dist_df(shots_df, outfile='procdata/shot_dist_df.csv', overwrite=True):
+def get_shot_dist_rows(pl_teams, min_starts, min_range, pl_bucket_df, tm_bucket_counts, pl_acc_df, pl_pps_df, add_teamname=True):
+    """
+    Build shot distribution rows (as per get_pl_data_dict) for each game time bucket and player
+    :param pl_teams: List of (player, team) tuples, in output order within each bucket
+    :param min_starts: Start minutes of the game time buckets
+    :param min_range: Width of the game time buckets - in minutes
+    :param pl_bucket_df: Shots made ('sum') and taken ('count') by (player, bucket)
+    :param tm_bucket_counts: Shots taken by (team, bucket)
+    :param pl_acc_df: Accuracies - indexed by player, with periods as columns
+    :param pl_pps_df: Points per shot - indexed by player, with periods as columns
+    :param add_teamname: Add team name to player names
+    :return:
+    """
+    n_pls = len(pl_teams)
+    players = np.array([p for p, _ in pl_teams], dtype=object)
+    pl_tms = np.array([t for _, t in pl_teams], dtype=object)
+    bucket_idx = np.repeat(np.arange(len(min_starts)), n_pls)
+    row_min_starts = np.repeat(min_starts, n_pls)
+    row_players = np.tile(players, len(min_starts))
+    row_tms = np.tile(pl_tms, len(min_starts))
+    periods = (row_min_starts // 12) + 1
+
+    pl_keys = pd.MultiIndex.from_arrays([row_players, bucket_idx])
+    shots_count = pl_bucket_df['count'].reindex(pl_keys, fill_value=0).values
+    shots_made = pl_bucket_df['sum'].reindex(pl_keys, fill_value=0).values
+    tm_counts = tm_bucket_counts.reindex(pd.MultiIndex.from_arrays([row_tms, bucket_idx]), fill_value=0).values
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shots_acc = np.where(shots_count > 0, shots_made / shots_count, 0)
+    # Python's round (rather than numpy's) for frequencies, as these were built from Python floats
+    shots_freq = [round(c / t * 100, 1) if t > 0 else 0 for c, t in zip(shots_count.tolist(), tm_counts.tolist())]
+
+    def lookup(stat_df):
+        stat_df = stat_df.reindex(columns=np.unique(periods), fill_value=0)
+        return stat_df.values[stat_df.index.get_indexer(row_players), stat_df.columns.get_indexer(periods)]
+
+    if add_teamname:
+        player_names = [p + ' [' + t + ']' for p, t in zip(row_players, row_tms)]
+    else:
+        player_names = list(row_players)
+
+    rows_df = pd.DataFrame(dict(
+        player=player_names,
+        pl_acc=np.round(lookup(pl_acc_df) * 100, 1),  # overall accuracy
+        pl_pps=np.round(lookup(pl_pps_df) * 100, 1),  # overall PPS
+        min_start=row_min_starts + 1,
+        min_mid=row_min_starts + 0.5,
+        min_end=row_min_starts + min_range,
+        shots_count=shots_count,
+        shots_made=shots_made,
+        shots_freq=shots_freq,
+        shots_acc=np.round(100 * shots_acc, 1),  # acc for the sample only
+    ))
+    return rows_df
+
 
+def build_shot_dist_df(shots_df, outfile='procdata/shot_dist_df.csv', overwrite=True, min_range=1):
+    """
+    Build a DataFrame of shot distributions over game time - for the leading players, and for each team's players
+    :param shots_df: Shots DataFrame (see process_shots_df)
+    :param outfile: Path to write the output to - not written if None
+    :param overwrite: Overwrite outfile without asking
+    :param min_range: Width of the game time buckets - in minutes
+    :return:
+    """
     import os
     import sys
 
@@ -411,89 +588,61 @@ def build_shot_dist_df(shots_df, outfile='procdata/shot_dist_df.csv', overwrite=
             teams_list.add(pl_team)
     top_players = top_players[::-1]
 
-    summary_data_list = list()
-
-    # Get player data
-    pl_acc_dict = dict()  # accuracies
-    pl_pps_dict = dict()  # points per shot
-
-    for player in shots_df.player.unique():
-        pl_q_acc_dict = dict()
-        pl_q_pps_dict = dict()
-        for period in shots_df.period.unique():
-            pl_df = shots_df[(shots_df.player == player) & (shots_df.period == period)]
-            # Are there are any shots?
-            if len(pl_df) > 0:
-                pl_q_acc_dict[period] = sum(pl_df.shot_made) / len(pl_df.shot_made)
-                pl_q_pps_dict[period] = (
-                        (3 * sum(pl_df[pl_df.is_three].shot_made) + 2 * sum(pl_df[pl_df.is_three == False].shot_made))
-                        / len(pl_df.shot_made)
-                )
-            else:
-                pl_q_acc_dict[period] = 0
-                pl_q_pps_dict[period] = 0
-
-        pl_acc_dict[player] = pl_q_acc_dict
-        pl_pps_dict[player] = pl_q_pps_dict
-
-    # Set up range (number of minutes)
-    min_range = 1
+    # Assign shots to game time buckets: (min_start, min_start + min_range]
+    min_starts = np.arange(0, 48, min_range)
+    bucket_edges = np.append(min_starts, min_starts[-1] + min_range)
+    buckets = np.searchsorted(bucket_edges, shots_df.tot_time.values, side='left') - 1
+    shots_df = shots_df.assign(
+        bucket=buckets, shot_made=shots_df.shot_made.astype(int),
+        shot_pts=shots_df.shot_made.astype(int) * np.where(shots_df.is_three == True, 3, 2)
+    )
+    bucket_df = shots_df[(buckets >= 0) & (buckets < len(min_starts))]
 
-    for min_start in range(0, 48, min_range):
-        min_end = min_start + min_range
-        time_df = shots_df[(shots_df.tot_time > min_start) & (shots_df.tot_time <= min_end)]
+    # Get player data - accuracies & points per shot by player and period
+    pl_period_df = shots_df.groupby(['player', 'period'])[['shot_made', 'shot_pts']].agg(['sum', 'count'])
+    pl_acc_df = (pl_period_df[('shot_made', 'sum')] / pl_period_df[('shot_made', 'count')]).unstack(fill_value=0)
+    pl_pps_df = (pl_period_df[('shot_pts', 'sum')] / pl_period_df[('shot_pts', 'count')]).unstack(fill_value=0)
 
-        for player, team in top_players:
-            pl_dict = get_pl_data_dict(time_df, player, team, pl_acc_dict, pl_pps_dict, min_start, min_end)
-            summary_data_list.append(pl_dict)
+    # Shot counts by game time bucket for each team, and for each player (across teams)
+    tm_bucket_counts = bucket_df.groupby(['team', 'bucket']).size()
+    pl_bucket_df = bucket_df.groupby(['player', 'bucket'])['shot_made'].agg(['sum', 'count'])
 
-    summary_df = pd.DataFrame(summary_data_list)
+    summary_df = get_shot_dist_rows(
+        [tuple(p) for p in top_players], min_starts, min_range,
+        pl_bucket_df, tm_bucket_counts, pl_acc_df, pl_pps_df, add_teamname=True
+    )
     summary_df = summary_df.assign(group="Leaders")
 
     part_thresh = 1  # Minimum % of team's shots to be shown on the chart
     # For each team:
     team_dfs = list()
-    for team in shots_df.team.unique():
-
-        team_df = shots_df[shots_df.team == team]
+    for team, team_df in shots_df.groupby('team', sort=False):
         player_counts = team_df.groupby('player').count()['game_id'].sort_values(ascending=True)
 
         # Consolidate non-qualifying players to 'Others'
         others_counts = player_counts[player_counts < sum(player_counts) / 100 * part_thresh]
-        for temp_name in list(others_counts.index):
-            team_df.player.replace(temp_name, 'Others', inplace=True)
+        team_df = team_df.assign(player=team_df.player.where(~team_df.player.isin(others_counts.index), 'Others'))
 
         player_counts = get_pl_shot_counts(team_df, crunchtime_mins=5)  # Sort by crunchtime shots, not just overall
 
-        # Get data for 'Others' as an aggreagate
+        # Get data for 'Others' as an aggreagate - the same for every period
         others_df = team_df[team_df.player == 'Others']
-        pl_q_acc_dict = dict()
-        pl_q_pps_dict = dict()
-        for period in shots_df.period.unique():
-            if len(others_df) > 0:
-                pl_q_acc_dict[period] = sum(others_df.shot_made) / len(others_df.shot_made)
-                pl_q_pps_dict[period] = (
-                        (3 * sum(others_df[others_df.is_three].shot_made) + 2 * sum(others_df[others_df.is_three == False].shot_made))
-                        / len(others_df.shot_made)
-                )
-            else:
-                pl_q_acc_dict[period] = 0
-                pl_q_pps_dict[period] = 0
-        pl_acc_dict['Others'] = pl_q_acc_dict
-        pl_pps_dict['Others'] = pl_q_pps_dict
-
-        team_summary_data_list = list()
-        min_range = 1
-
-        for min_start in range(0, 48, min_range):
-            min_end = min_start + min_range
-            time_df = team_df[(team_df.tot_time > min_start) & (team_df.tot_time <= min_end)]
+        tm_acc_df = pl_acc_df.drop(index='Others', errors='ignore')
+        tm_pps_df = pl_pps_df.drop(index='Others', errors='ignore')
+        if len(others_df) > 0:
+            tm_acc_df.loc['Others'] = others_df.shot_made.sum() / len(others_df)
+            tm_pps_df.loc['Others'] = others_df.shot_pts.sum() / len(others_df)
+        else:
+            tm_acc_df.loc['Others'] = 0
+            tm_pps_df.loc['Others'] = 0
 
-            for player, team in player_counts.index:
-                pl_dict = get_pl_data_dict(time_df, player, team, pl_acc_dict, pl_pps_dict, min_start, min_end, add_teamname=False)
-                team_summary_data_list.append(pl_dict)
+        team_bucket_df = team_df[(team_df.bucket >= 0) & (team_df.bucket < len(min_starts))]
+        tm_pl_bucket_df = team_bucket_df.groupby(['player', 'bucket'])['shot_made'].agg(['sum', 'count'])
 
-        team_summary_df = pd.DataFrame(team_summary_data_list)
+        team_summary_df = get_shot_dist_rows(
+            list(player_counts.index), min_starts, min_range,
+            tm_pl_bucket_df, tm_bucket_counts, tm_acc_df, tm_pps_df, add_teamname=False
+        )
         team_summary_df = team_summary_df.assign(group=team)
         team_dfs.append(team_summary_df)
 
@@ -605,69 +754,116 @@ def add_polar_bins_new(shots_df):
     return shots_df
 
 
-def grp_polar_shots(shots_df_in, tbin_smoothing_bins=2, min_shots=0.0005):
+def grp_polar_shots(shots_df_in, tbin_smoothing_bins=2, min_shots=0.0005, grp_cols=None):
     """
     :param shots_df_in:
     :param tbin_smoothing_bins: How many adjacent (anglular) bins to use for data smoothing
+    :param min_shots: Bins with fewer than this fraction of all attempts get attempts set to 0 - None for no filtering
+    :param grp_cols: Column(s) to group by (e.g. "team") - to get stats for each group separately in one call
     :return:
     """
+    if grp_cols is None:
+        grp_cols = list()
+    elif type(grp_cols) == str:
+        grp_cols = [grp_cols]
+    else:
+        grp_cols = list(grp_cols)
+
     if "original_x" in shots_df_in.columns:
         made_col = "shot_made"
+        shot_values = np.where(shots_df_in["is_three"] == True, 3, np.where(shots_df_in["is_three"] == False, 2, 0))
     else:
         made_col = "made"
+        shot_values = np.where(shots_df_in["value"] == 3, 3, np.where(shots_df_in["value"] == 2, 2, 0))
 
-    grp_shots_df_in = shots_df_in.groupby(["tbin", "rbin"]).count()["period"]
-    grp_makes_df = shots_df_in.groupby(["tbin", "rbin"]).sum()[made_col]
-    grp_pcts_df = grp_makes_df / grp_shots_df_in
-
-    if "original_x" in shots_df_in.columns:
-        grp_scores_df = shots_df_in.groupby(["tbin", "rbin", "is_three"]).sum()[made_col].reset_index()
-        grp_scores_df = grp_scores_df.assign(points=0)
-        grp_scores_df.loc[grp_scores_df["is_three"] == True, "points"] = grp_scores_df[grp_scores_df["is_three"] == True][made_col] * 3
-        grp_scores_df.loc[grp_scores_df["is_three"] == False, "points"] = grp_scores_df[grp_scores_df["is_three"] == False][made_col] * 2
+    bin_cols = grp_cols + ["tbin", "rbin"]
+    tmp_df = shots_df_in[bin_cols + ["period"]].assign(
+        made=shots_df_in[made_col].astype(int), points=shots_df_in[made_col].astype(int) * shot_values
+    )
+    grp_shots_df = tmp_df.groupby(bin_cols).agg(
+        attempts=("period", "count"), makes=("made", "sum"), points=("points", "sum")
+    ).reset_index()
+
+    grp_shots_df = grp_shots_df.assign(pct=100 * (grp_shots_df["makes"] / grp_shots_df["attempts"]))
+    grp_shots_df = grp_shots_df.assign(pps=grp_shots_df["points"] / grp_shots_df["attempts"] * 100)
+    grp_shots_df = grp_shots_df.drop(columns=["makes", "points"])
+
+    # Relative accuracy - compared to the average of the bin & its mirror image
+    mirror_avgs = grp_shots_df.assign(abs_tbin=np.abs(grp_shots_df["tbin"])).groupby(grp_cols + ["abs_tbin", "rbin"])["pct"].transform("mean")
+    grp_shots_df = grp_shots_df.assign(rel_pct=grp_shots_df["pct"] - mirror_avgs)
+    grp_shots_df = grp_shots_df.assign(better_side=np.sign(grp_shots_df.rel_pct))
+
+    # Group-level totals (or overall totals if no groups)
+    def get_tbin_thresh(tbins):
+        uniq_tbins = np.sort(tbins.unique())
+        if len(uniq_tbins) < 2:
+            return 0
+        return tbin_smoothing_bins * abs(uniq_tbins[0] - uniq_tbins[1])
+
+    if len(grp_cols) > 0:
+        grp_stats_df = shots_df_in.groupby(grp_cols).agg(n_shots=("tbin", "size"), tbin_thresh=("tbin", get_tbin_thresh))
+        grp_stats_df = grp_shots_df[grp_cols].merge(grp_stats_df.reset_index(), on=grp_cols, how="left")
+        n_shots = grp_stats_df["n_shots"].values
+        row_threshes = grp_stats_df["tbin_thresh"].values
+        grp_codes = grp_shots_df.groupby(grp_cols).ngroup().values
     else:
-        grp_scores_df = shots_df_in.groupby(["tbin", "rbin", "value"]).sum()[made_col].reset_index()
-        grp_scores_df = grp_scores_df.assign(points=0)
-        grp_scores_df.loc[grp_scores_df["value"] == 3, "points"] = grp_scores_df[grp_scores_df["value"] == 3][made_col] * 3
-        grp_scores_df.loc[grp_scores_df["value"] == 2, "points"] = grp_scores_df[grp_scores_df["value"] == 2][made_col] * 2
-
-    grp_scores_df = grp_scores_df.groupby(["tbin", "rbin"]).sum()["points"]
-    # No averaging - at the same distance
-    grp_pps_df = grp_scores_df / grp_shots_df_in * 100
-
-    grp_shots_df_in = grp_shots_df_in.reset_index()
-    grp_shots_df_in = grp_shots_df_in.rename({"period": "attempts"}, axis=1)
-    grp_shots_df_in = grp_shots_df_in.assign(pct=100 * grp_pcts_df.reset_index()[0])
-    grp_shots_df_in = grp_shots_df_in.assign(pps=grp_pps_df.values)
-
-    grp_shots_df_in = grp_shots_df_in.assign(rel_pct=0)
-    for i, row in grp_shots_df_in.iterrows():
-        avg = grp_shots_df_in[(np.abs(grp_shots_df_in["tbin"]) == np.abs(row["tbin"])) & (grp_shots_df_in["rbin"] == row["rbin"])].pct.mean()
-        grp_shots_df_in.loc[i, "rel_pct"] = row["pct"] - avg
-    grp_shots_df_in = grp_shots_df_in.assign(better_side=np.sign(grp_shots_df_in.rel_pct))
-    grp_shots_df_in = grp_shots_df_in.assign(freq_pct=np.round(grp_shots_df_in.attempts/len(shots_df_in) * 100, 2))
-    grp_shots_df_in = grp_shots_df_in.assign(pts_pct=np.round((grp_shots_df_in.attempts * grp_shots_df_in.pps) / sum((grp_shots_df_in.attempts * grp_shots_df_in.pps)) * 100, 2))
+        n_shots = len(shots_df_in)
+        row_threshes = np.full(len(grp_shots_df), get_tbin_thresh(shots_df_in["tbin"]))
+        grp_codes = np.zeros(len(grp_shots_df), dtype=int)
+    tot_pts = grp_shots_df.attempts * grp_shots_df.pps
+    grp_shots_df = grp_shots_df.assign(freq_pct=np.round(grp_shots_df.attempts / n_shots * 100, 2))
+    grp_shots_df = grp_shots_df.assign(pts_pct=np.round(tot_pts / tot_pts.groupby(grp_codes).transform("sum") * 100, 2))
 
     # Perform averaging for PPS - keep distance constant, only average by adjacent angle bins
-    tbin_thresh = tbin_smoothing_bins * abs(np.sort(shots_df_in.tbin.unique())[0] - np.sort(shots_df_in.tbin.unique())[1])
-    for i, row in grp_shots_df_in.iterrows():
-        temp_rows = grp_shots_df_in[
-            (grp_shots_df_in["rbin"] == row["rbin"]) &
-            (grp_shots_df_in["tbin"] <= row["tbin"] + tbin_thresh) &
-            (grp_shots_df_in["tbin"] >= row["tbin"] - tbin_thresh)
-        ]
-        tot_pts = np.sum(temp_rows["pps"] * temp_rows["attempts"])  # Make sure to average using totals
-        tot_shots = np.sum(temp_rows["attempts"])
-        mean_pps = tot_pts/tot_shots
-        grp_shots_df_in.loc[row.name, "pps"] = mean_pps
+    # Bins are pivoted to a (group & rbin) x tbin grid, and summed over a band of tbins for each tbin
+    tbin_vals = np.sort(grp_shots_df["tbin"].unique())
+    col_idx = np.searchsorted(tbin_vals, grp_shots_df["tbin"].values)
+    row_idx = grp_shots_df.groupby(grp_cols + ["rbin"], sort=False).ngroup().values
+    n_rows = row_idx.max() + 1 if len(row_idx) > 0 else 0
+    pts_grid = np.zeros((n_rows, len(tbin_vals)))
+    atts_grid = np.zeros((n_rows, len(tbin_vals)))
+    pts_grid[row_idx, col_idx] = tot_pts.values  # Make sure to average using totals
+    atts_grid[row_idx, col_idx] = grp_shots_df["attempts"].values
+
+    smoothed_pps = np.zeros(len(grp_shots_df))
+    for tbin_thresh in np.unique(row_threshes):
+        band = ((tbin_vals[:, np.newaxis] <= tbin_vals[np.newaxis, :] + tbin_thresh)
+                & (tbin_vals[:, np.newaxis] >= tbin_vals[np.newaxis, :] - tbin_thresh))
+        thresh_mask = row_threshes == tbin_thresh
+        band_pts = (pts_grid @ band)[row_idx[thresh_mask], col_idx[thresh_mask]]
+        band_atts = (atts_grid @ band)[row_idx[thresh_mask], col_idx[thresh_mask]]
+        smoothed_pps[thresh_mask] = band_pts / band_atts
+    grp_shots_df = grp_shots_df.assign(pps=smoothed_pps)
 
     if min_shots is not None:
-        for i, row in grp_shots_df_in.iterrows():
-            min_samples = 0.0005
-            if row["attempts"] < (grp_shots_df_in["attempts"].sum() * min_samples):
-                grp_shots_df_in.loc[row.name, "attempts"] = 0
+        grp_atts = grp_shots_df["attempts"].groupby(grp_codes).transform("sum")
+        grp_shots_df.loc[grp_shots_df["attempts"] < (grp_atts * min_shots), "attempts"] = 0
+
+    return grp_shots_df
+
+
+def get_grouped_polar_shots(shots_df, grp_cols, rbin_size=30, large_tbins=True, tbin_smoothing_bins=2, min_shots=0.0005, as_dict=False):
+    """
+    Get polar shot stats (as per grp_polar_shots) for every team / player / lineup etc. in one call.
+    Polar columns & bins are calculated once for the whole shots frame, unless already present.
+    :param shots_df: Shots DataFrame
+    :param grp_cols: Column(s) to group by - e.g. "team", "player", ["team", "period"], or lineups via LineupIndex.lineup_idx
+    :param rbin_size: Radial bin size (see add_polar_bins)
+    :param large_tbins: Use large angular bins (see add_polar_bins)
+    :param tbin_smoothing_bins: How many adjacent (anglular) bins to use for data smoothing
+    :param min_shots: Bins with fewer than this fraction of the group's attempts get attempts set to 0 - None for no filtering
+    :param as_dict: Return a dict of group key -> stats DataFrame (e.g. for viz.plot_polar_pps) rather than one DataFrame
+    :return:
+    """
+    if "tbin" not in shots_df.columns or "rbin" not in shots_df.columns:
+        shots_df = add_polar_columns(shots_df)
+        shots_df = add_polar_bins(shots_df, rbin_size=rbin_size, large_tbins=large_tbins)
+
+    grp_shots_df = grp_polar_shots(shots_df, tbin_smoothing_bins=tbin_smoothing_bins, min_shots=min_shots, grp_cols=grp_cols)
 
-    return grp_shots_df_in
+    if as_dict:
+        return {grp_key: grp_df.reset_index(drop=True) for grp_key, grp_df in grp_shots_df.groupby(grp_cols, sort=False)}
+    return grp_shots_df
 
 
 def grp_polar_shots_simp(grp_shots_df):
@@ -0,0 +1,474 @@
+# ========== (c) JP Hwang 18/10/2026  ==========
+
+import logging
+from functools import lru_cache
+import numpy as np
+
+# ===== START LOGGER =====
+logger = logging.getLogger(__name__)
+
+# Half court extent, in the (x_min, x_max, y_min, y_max) order used by matplotlib's hexbin
+def_extent = (-250, 250, 422.5, -47.5)
+hex_grid_dir = "data/proc_data/hex_grids"  # Disk cache of hex grid geometries
+hex_grid_version = 1  # Bump if the stored hex grid arrays change format
+
+
+def get_hexbin_grid(gridsize, extent=def_extent):
+    """
+    Get hexagonal grid parameters, as per matplotlib's Axes.hexbin
+    :param gridsize: Number of hexagons in the x-direction (or (nx, ny) tuple)
+    :param extent: (x_min, x_max, y_min, y_max) of the grid
+    :return: Dict of nx, ny, xmin, ymin, sx, sy
+    """
+    import math
+
+    if np.iterable(gridsize):
+        nx, ny = gridsize
+    else:
+        nx = gridsize
+        ny = int(nx / math.sqrt(3))
+
+    xmin, xmax, ymin, ymax = extent
+    # In the x-direction, the hexagons exactly cover the region from xmin to xmax - pad to avoid roundoff errors
+    padding = 1.e-9 * (xmax - xmin)
+    xmin -= padding
+    xmax += padding
+    sx = (xmax - xmin) / nx
+    sy = (ymax - ymin) / ny
+
+    return {"nx": nx, "ny": ny, "xmin": xmin, "ymin": ymin, "sx": sx, "sy": sy}
+
+
+def get_hexbin_offsets(gridsize, extent=def_extent):
+    """
+    Get hexagon centers - in the same order as matplotlib's hexbin offsets
+    :param gridsize: Number of hexagons in the x-direction (or (nx, ny) tuple)
+    :param extent: (x_min, x_max, y_min, y_max) of the grid
+    :return: (n_hexes, 2) array of x, y locations
+    """
+    grid = get_hexbin_grid(gridsize, extent)
+    nx1, ny1 = grid["nx"] + 1, grid["ny"] + 1
+    nx2, ny2 = grid["nx"], grid["ny"]
+
+    offsets = np.zeros((nx1 * ny1 + nx2 * ny2, 2), float)
+    offsets[:nx1 * ny1, 0] = np.repeat(np.arange(nx1), ny1)
+    offsets[:nx1 * ny1, 1] = np.tile(np.arange(ny1), nx1)
+    offsets[nx1 * ny1:, 0] = np.repeat(np.arange(nx2) + 0.5, ny2)
+    offsets[nx1 * ny1:, 1] = np.tile(np.arange(ny2), nx2) + 0.5
+    offsets[:, 0] *= grid["sx"]
+    offsets[:, 1] *= grid["sy"]
+    offsets[:, 0] += grid["xmin"]
+    offsets[:, 1] += grid["ymin"]
+
+    return offsets
+
+
+def get_hexbin_indices(x, y, gridsize, extent=def_extent):
+    """
+    Get the hexagon (as an index of get_hexbin_offsets) that each point falls in
+    :param x: x coordinates (array-like)
+    :param y: y coordinates (array-like)
+    :param gridsize: Number of hexagons in the x-direction (or (nx, ny) tuple)
+    :param extent: (x_min, x_max, y_min, y_max) of the grid
+    :return: Array of hexagon indices; -1 for points outside the grid, or with missing coordinates
+    """
+    grid = get_hexbin_grid(gridsize, extent)
+    nx1, ny1 = grid["nx"] + 1, grid["ny"] + 1
+    nx2, ny2 = grid["nx"], grid["ny"]
+
+    x = np.asarray(x, float)
+    y = np.asarray(y, float)
+    valid = np.isfinite(x) & np.isfinite(y)
+    x = np.where(valid, x, 0)
+    y = np.where(valid, y, 0)
+
+    # Positions in hexagon index coordinates - two offset rectangular lattices, and take the closer one
+    ix = (x - grid["xmin"]) / grid["sx"]
+    iy = (y - grid["ymin"]) / grid["sy"]
+    ix1 = np.round(ix).astype(int)
+    iy1 = np.round(iy).astype(int)
+    ix2 = np.floor(ix).astype(int)
+    iy2 = np.floor(iy).astype(int)
+    i1 = np.where((0 <= ix1) & (ix1 < nx1) & (0 <= iy1) & (iy1 < ny1), ix1 * ny1 + iy1, -1)
+    i2 = np.where((0 <= ix2) & (ix2 < nx2) & (0 <= iy2) & (iy2 < ny2), nx1 * ny1 + ix2 * ny2 + iy2, -1)
+
+    d1 = (ix - ix1) ** 2 + 3.0 * (iy - iy1) ** 2
+    d2 = (ix - ix2 - 0.5) ** 2 + 3.0 * (iy - iy2 - 0.5) ** 2
+    hex_idx = np.where(d1 < d2, i1, i2)
+    hex_idx[~valid] = -1
+
+    return hex_idx
+
+
+def count_hexbins(hex_idx, n_hexes, weights=None):
+    """
+    Count (or sum weights of) points in each hexagon
+    :param hex_idx: Hexagon indices (see get_hexbin_indices)
+    :param n_hexes: Total number of hexagons in the grid
+    :param weights: Optional weights for each point
+    :return: Float array of counts by hexagon
+    """
+    in_grid = hex_idx >= 0
+    if weights is not None:
+        weights = np.asarray(weights, float)[in_grid]
+    return np.bincount(hex_idx[in_grid], weights=weights, minlength=n_hexes).astype(float)
+
+
+def get_hexbin_counts(x, y, gridsize, extent=def_extent):
+    """
+    Get hexagon centers and the number of points in each - as per matplotlib's hexbin offsets & array
+    :param x: x coordinates (array-like)
+    :param y: y coordinates (array-like)
+    :param gridsize: Number of hexagons in the x-direction (or (nx, ny) tuple)
+    :param extent: (x_min, x_max, y_min, y_max) of the grid
+    :return: Tuple of (offsets, counts)
+    """
+    offsets = get_hexbin_offsets(gridsize, extent)
+    hex_idx = get_hexbin_indices(x, y, gridsize, extent)
+    return offsets, count_hexbins(hex_idx, len(offsets))
+
+
+def get_box_neighbours(x, y, x_radius, y_radius):
+    """
+    Find, for each point, all points within a box: |dx| < x_radius and |dy| < y_radius.
+    Candidates are found with a KD-tree query on scaled coordinates, then filtered exactly.
+    :param x: x coordinates (array)
+    :param y: y coordinates (array)
+    :param x_radius: Half-width of the box
+    :param y_radius: Half-height of the box
+    :return: Tuple of CSR-style (indptr, indices) arrays - neighbours of point i are indices[indptr[i]:indptr[i + 1]]
+    """
+    from scipy.spatial import cKDTree
+
+    x = np.asarray(x, float)
+    y = np.asarray(y, float)
+    if x_radius <= 0 or y_radius <= 0 or len(x) == 0:
+        return np.zeros(len(x) + 1, dtype=int), np.zeros(0, dtype=int)
+
+    # Chebyshev (max-norm) ball of radius 1 in scaled coordinates == the box; pad the radius to allow for rounding
+    scaled = np.column_stack([x / x_radius, y / y_radius])
+    candidates = cKDTree(scaled).query_ball_point(scaled, r=1 + 1e-9, p=np.inf)
+
+    nbr_lists = list()
+    for i, cands in enumerate(candidates):
+        cands = np.sort(np.asarray(cands, dtype=int))
+        in_box = (np.abs(x[cands] - x[i]) < x_radius) & (np.abs(y[cands] - y[i]) < y_radius)
+        nbr_lists.append(cands[in_box])
+    indptr = np.concatenate([[0], np.cumsum([len(nbrs) for nbrs in nbr_lists])])
+    indices = np.concatenate(nbr_lists)
+    return indptr, indices
+
+
+def smooth_hex_values(values, adjacency):
+    """
+    Sum values over each hex's neighbourhood
+    :param values: Values by hex (or 2D array - hexes x stats)
+    :param adjacency: Sparse (n_hexes x n_hexes) neighbourhood matrix (see HexGrid.adjacency)
+    :return: Array of neighbourhood sums
+    """
+    return adjacency @ np.asarray(values, float)
+
+
+def smooth_hex_ratio(numerators, denominators, adjacency):
+    """
+    Local average of a ratio (e.g. makes / shots) - neighbourhood sum of numerators over that of denominators
+    :param numerators: Numerator values by hex
+    :param denominators: Denominator values by hex
+    :param adjacency: Sparse (n_hexes x n_hexes) neighbourhood matrix (see HexGrid.adjacency)
+    :return: Array of smoothed ratios; 0 where the neighbourhood denominator is 0
+    """
+    nbr_sums = smooth_hex_values(np.column_stack([numerators, denominators]), adjacency)
+    ratios = np.zeros(len(nbr_sums))
+    has_vals = nbr_sums[:, 1] > 0
+    ratios[has_vals] = nbr_sums[has_vals, 0] / nbr_sums[has_vals, 1]
+    return ratios
+
+
+class HexGrid:
+    """
+    Geometry of a hexagonal grid, which is constant for a gridsize & extent:
+    hexagon centers, their court zones, the three-point mask and smoothing neighbourhoods.
+    Neighbourhoods are stored as CSR-style arrays - the neighbours of hex i are nbr_indices[nbr_indptr[i]:nbr_indptr[i + 1]]
+    """
+    def __init__(self, gridsize, extent=def_extent, smoothing=2.5, arrays=None):
+        """
+        :param gridsize: Number of hexagons in the x-direction (or (nx, ny) tuple)
+        :param extent: (x_min, x_max, y_min, y_max) of the grid
+        :param smoothing: Neighbourhood size for local averaging - in hexagon spacings
+        :param arrays: Precalculated arrays (see to_arrays) - calculated if None
+        """
+        self.gridsize = gridsize
+        self.extent = tuple(extent)
+        self.smoothing = smoothing
+        if arrays is None:
+            arrays = self._build_arrays()
+
+        self.offsets = arrays["offsets"]
+        self.xlocs = self.offsets[:, 0]
+        self.ylocs = self.offsets[:, 1]
+        self.threes_mask = arrays["threes_mask"]
+        self.x_spacing = float(arrays["spacing"][0])
+        self.y_spacing = float(arrays["spacing"][1])
+        self.nbr_indptr = arrays["nbr_indptr"]
+        self.nbr_indices = arrays["nbr_indices"]
+        self._zone_codes = arrays["zone_codes"]
+        self._zone_cats = arrays["zone_cats"]
+        self._simple_zone_codes = arrays["simple_zone_codes"]
+        self._simple_zone_cats = arrays["simple_zone_cats"]
+        self._adjacency = None
+
+    @property
+    def n_hexes(self):
+        return len(self.offsets)
+
+    @property
+    def adjacency(self):
+        """
+        Sparse (n_hexes x n_hexes) matrix of smoothing neighbourhoods
+        """
+        if self._adjacency is None:
+            from scipy.sparse import csr_matrix
+            self._adjacency = csr_matrix(
+                (np.ones(len(self.nbr_indices)), self.nbr_indices, self.nbr_indptr), shape=(self.n_hexes, self.n_hexes)
+            )
+        return self._adjacency
+
+    @property
+    def shot_zones(self):
+        import pandas as pd
+        return pd.Categorical.from_codes(self._zone_codes, categories=list(self._zone_cats))
+
+    @property
+    def simple_zones(self):
+        import pandas as pd
+        return pd.Categorical.from_codes(self._simple_zone_codes, categories=list(self._simple_zone_cats))
+
+    def _build_arrays(self):
+        from dataproc import get_zone_arrays
+
+        offsets = get_hexbin_offsets(self.gridsize, self.extent)
+        x, y = offsets[:, 0], offsets[:, 1]
+
+        threes_mask = (x < -220) | (x > 220) | ((x ** 2 + y ** 2) ** 0.5 > 237.5)
+
+        shot_zones, simple_zones = get_zone_arrays(x, y)
+
+        # Neighbourhoods - hexes within (smoothing x spacing) in both the x & y directions
+        uniq_x = np.sort(np.unique(x))
+        uniq_y = np.sort(np.unique(y))
+        spacing = np.array([uniq_x[1] - uniq_x[0], uniq_y[1] - uniq_y[0]])
+        nbr_indptr, nbr_indices = get_box_neighbours(x, y, spacing[0] * self.smoothing, spacing[1] * self.smoothing)
+
+        return {
+            "offsets": offsets, "threes_mask": threes_mask, "spacing": spacing,
+            "nbr_indptr": nbr_indptr, "nbr_indices": nbr_indices,
+            "zone_codes": shot_zones.codes, "zone_cats": np.array(shot_zones.categories, dtype=str),
+            "simple_zone_codes": simple_zones.codes, "simple_zone_cats": np.array(simple_zones.categories, dtype=str),
+        }
+
+    def to_arrays(self):
+        return {
+            "offsets": self.offsets, "threes_mask": self.threes_mask, "spacing": np.array([self.x_spacing, self.y_spacing]),
+            "nbr_indptr": self.nbr_indptr, "nbr_indices": self.nbr_indices,
+            "zone_codes": self._zone_codes, "zone_cats": self._zone_cats,
+            "simple_zone_codes": self._simple_zone_codes, "simple_zone_cats": self._simple_zone_cats,
+        }
+
+    def get_indices(self, x, y):
+        """
+        Get the hexagon that each point falls in (see get_hexbin_indices)
+        """
+        return get_hexbin_indices(x, y, self.gridsize, self.extent)
+
+    def count(self, hex_idx, weights=None):
+        """
+        Count (or sum weights of) points in each hexagon (see count_hexbins)
+        """
+        return count_hexbins(hex_idx, self.n_hexes, weights=weights)
+
+
+@lru_cache(maxsize=1)
+def get_hex_grid_schema():
+    """
+    Get a tag for the hex grid definition - the format version, and a hash of the code that builds the
+    geometry, zones & three-point mask - so that disk cache files from older definitions are not reused
+    :return: Tag string
+    """
+    import hashlib
+    import inspect
+    from dataproc import get_zone_arrays
+
+    hasher = hashlib.sha1(str(hex_grid_version).encode())
+    try:
+        for func in [get_hexbin_grid, get_hexbin_offsets, get_box_neighbours, HexGrid._build_arrays, get_zone_arrays]:
+            hasher.update(inspect.getsource(func).encode())
+    except (OSError, TypeError):
+        logger.warning("Source code unavailable - hex grid disk cache is keyed by the format version only")
+    return f"v{hex_grid_version}-{hasher.hexdigest()[:8]}"
+
+
+def get_hex_grid_fpath(gridsize, extent=def_extent, smoothing=2.5):
+    """
+    Get the disk cache path for a hex grid geometry
+    """
+    import os
+    grid_label = "x".join(str(g) for g in np.atleast_1d(gridsize))
+    extent_label = "_".join(str(e) for e in extent)
+    return os.path.join(hex_grid_dir, f"hexgrid_{grid_label}_{extent_label}_{smoothing}_{get_hex_grid_schema()}.npz")
+
+
+def get_hex_grid(gridsize, extent=def_extent, smoothing=2.5, use_disk=False):
+    """
+    Get hex grid geometry - built once per (gridsize, extent, smoothing), and cached in memory (and optionally on disk)
+    :param gridsize: Number of hexagons in the x-direction (or (nx, ny) tuple)
+    :param extent: (x_min, x_max, y_min, y_max) of the grid
+    :param smoothing: Neighbourhood size for local averaging - in hexagon spacings
+    :param use_disk: Also load from / save to the disk cache (hex_grid_dir)
+    :return: HexGrid
+    """
+    if np.iterable(gridsize):
+        gridsize = tuple(gridsize)
+    return _get_hex_grid(gridsize, tuple(extent), smoothing, use_disk)
+
+
+@lru_cache(maxsize=32)
+def _get_hex_grid(gridsize, extent, smoothing, use_disk):
+    import os
+
+    fpath = get_hex_grid_fpath(gridsize, extent, smoothing)
+    if use_disk and os.path.exists(fpath):
+        try:
+            with np.load(fpath) as npz:
+                arrays = {k: npz[k] for k in npz.files}
+            return HexGrid(gridsize, extent, smoothing, arrays=arrays)
+        except:
+            logger.exception(f"Error loading hex grid from {fpath} - rebuilding")
+
+    hex_grid = HexGrid(gridsize, extent, smoothing)
+    if use_disk:
+        try:
+            os.makedirs(hex_grid_dir, exist_ok=True)
+            tmp_fpath = fpath + ".tmp.npz"
+            np.savez(tmp_fpath, **hex_grid.to_arrays())
+            os.replace(tmp_fpath, fpath)
+        except:
+            logger.exception(f"Error saving hex grid to {fpath}")
+    return hex_grid
+
+
+class HexbinStats:
+    """
+    Shot stats by hexbin, as parallel arrays (one element per hex).
+    Supports dict-style access (e.g. stats["accs_by_hex"]) for compatibility with the old dict output
+    """
+    array_fields = ("xlocs", "ylocs", "shots_by_hex", "freq_by_hex", "accs_by_hex", "shot_ev_by_hex")
+    scalar_fields = ("gridsize", "n_shots")
+    __slots__ = array_fields + scalar_fields
+
+    def __init__(self, xlocs, ylocs, shots_by_hex, freq_by_hex, accs_by_hex, shot_ev_by_hex, gridsize=None, n_shots=0):
+        self.xlocs = np.asarray(xlocs)
+        self.ylocs = np.asarray(ylocs)
+        self.shots_by_hex = np.asarray(shots_by_hex)
+        self.freq_by_hex = np.asarray(freq_by_hex)
+        self.accs_by_hex = np.asarray(accs_by_hex)
+        self.shot_ev_by_hex = np.asarray(shot_ev_by_hex)
+        self.gridsize = gridsize
+        self.n_shots = n_shots
+
+        n_hexes = len(self.xlocs)
+        for k in self.array_fields:
+            if len(getattr(self, k)) != n_hexes:
+                raise ValueError(f"The {k} array has length {len(getattr(self, k))}, expected {n_hexes}")
+
+    def __len__(self):
+        return len(self.xlocs)
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, np.asarray(value) if key in self.array_fields else value)
+
+    def __contains__(self, key):
+        return key in self.__slots__
+
+    def __iter__(self):
+        return iter(self.__slots__)
+
+    def keys(self):
+        return list(self.__slots__)
+
+    def items(self):
+        return [(k, getattr(self, k)) for k in self.__slots__]
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def copy(self):
+        return HexbinStats(*[getattr(self, k).copy() for k in self.array_fields],
+                           **{k: getattr(self, k) for k in self.scalar_fields})
+
+    def filter(self, mask):
+        """
+        Keep only the hexes where mask is True
+        :param mask: Boolean array, one element per hex
+        :return: New HexbinStats
+        """
+        mask = np.asarray(mask, dtype=bool)
+        return HexbinStats(*[getattr(self, k)[mask] for k in self.array_fields],
+                           **{k: getattr(self, k) for k in self.scalar_fields})
+
+    def filter_by_freq(self, min_threshold=0.0):
+        """
+        Keep only the hexes with frequencies above a threshold value
+        :param min_threshold:
+        :return: New HexbinStats
+        """
+        return self.filter(self.freq_by_hex > min_threshold)
+
+    def clip(self, key, minval=None, maxval=None):
+        """
+        Zero the frequencies (in place) of hexes where the given stat is outside of [minval, maxval]
+        :param key: Stat name, e.g. accs_by_hex
+        :param minval:
+        :param maxval:
+        :return: self
+        """
+        if minval is None and maxval is None:
+            logger.warning('Nothing is going to be clipped! Check your parameters.')
+            return self
+
+        vals = self[key]
+        outside = np.zeros(len(self), dtype=bool)
+        if minval is not None:
+            outside |= vals < minval
+        if maxval is not None:
+            outside |= vals > maxval
+        self.freq_by_hex = self.freq_by_hex.copy()
+        self.freq_by_hex[outside] = 0
+        return self
+
+    def capped_freq(self, max_freq=0.002):
+        """
+        Frequencies capped at a maximum value (NaNs become max_freq)
+        :param max_freq:
+        :return: Array of frequencies
+        """
+        return np.fmin(self.freq_by_hex, max_freq)
+
+    def relative_to(self, base_stats):
+        """
+        Accuracies and shot values relative to a baseline on the same grid
+        :param base_stats: Baseline HexbinStats (e.g. league-wide)
+        :return: New HexbinStats
+        """
+        if len(base_stats) != len(self):
+            raise ValueError(f"Baseline has {len(base_stats)} hexes, expected {len(self)} - was it built on the same grid?")
+        rel_stats = self.copy()
+        rel_stats.accs_by_hex = self.accs_by_hex - base_stats.accs_by_hex
+        rel_stats.shot_ev_by_hex = self.shot_ev_by_hex - base_stats.shot_ev_by_hex
+        return rel_stats
@@ -0,0 +1,138 @@
+# ========== (c) JP Hwang 18/10/2026  ==========
+# Benchmark dataproc.process_shots_df against the previous row-by-row tot_time / garbage-time loops,
+# and check that the garbage-time flags follow their rows when the input index is not a RangeIndex.
+# Run from the repo root: python scripts/bench_process_shots_df.py [n_shots]
+
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import numpy as np
+import pandas as pd
+import dataproc
+
+logger = logging.getLogger(__name__)
+root_logger = logging.getLogger()
+root_logger.setLevel(logging.WARNING)
+sh = logging.StreamHandler()
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+sh.setFormatter(formatter)
+root_logger.addHandler(sh)
+
+
+def make_log_df(n_rows, seed=0, non_shot_frac=0.0):
+    """
+    Synthetic log rows with the columns used by process_shots_df
+    :param n_rows: Number of rows
+    :param seed: Random seed
+    :param non_shot_frac: Fraction of rows that are not shots (dropped by process_shots_df, leaving index gaps)
+    :return: DataFrame with a RangeIndex
+    """
+    rng = np.random.default_rng(seed)
+    period = rng.choice([1, 2, 3, 4, 4, 4, 5, 6], n_rows)
+    mins = np.where(period < 5, rng.integers(0, 12, n_rows), rng.integers(0, 5, n_rows))
+    secs = rng.integers(0, 60, n_rows)
+    event_type = np.where(rng.random(n_rows) < non_shot_frac, "rebound", rng.choice(["shot", "miss"], n_rows))
+    log_df = pd.DataFrame({
+        "event_type": event_type,
+        "original_x": rng.integers(-250, 250, n_rows).astype(float),
+        "original_y": rng.integers(-40, 400, n_rows).astype(float),
+        "period": period,
+        "remaining_time": [f"0:{m:02d}:{s:02d}" for m, s in zip(mins, secs)],
+        "home_score": rng.integers(0, 130, n_rows),
+        "away_score": rng.integers(0, 130, n_rows),
+    })
+    log_df["shot_distance"] = (np.hypot(log_df.original_x, log_df.original_y) / 10).round()
+    return log_df
+
+
+def ref_time_cols(shots_df):
+    """
+    Previous loop-based tot_time & garbage columns, applied to the output of process_shots_df
+    :param shots_df: Processed shots DataFrame (uses period, remaining_time & score_diff)
+    :return: Tuple - (tot_time list, garbage Series as the old code assigned it)
+    """
+    remaining_time = [i.split(':') for i in list(shots_df['remaining_time'])]
+    tot_time = list()
+    for i in range(len(shots_df)):
+        if shots_df.iloc[i]['period'] < 5:
+            tmp_gametime = ((shots_df.iloc[i]['period'] - 1) * 12) + (11 - int(remaining_time[i][1])) + (1 - (int(remaining_time[i][2]) / 60))
+        else:
+            tmp_gametime = 48.0 + ((shots_df.iloc[i]['period'] - 5) * 5) + (4 - int(remaining_time[i][1])) + (1 - (int(remaining_time[i][2]) / 60))
+        tot_time.append(tmp_gametime)
+
+    garbage_marker = pd.Series([False] * len(shots_df))
+    for i, row in shots_df.iterrows():
+        if (row["period"] == 4):
+            rem_mins = row["remaining_time"].split(":")[1]
+            score_threshold = 13 + int(rem_mins)
+            if row["score_diff"] >= score_threshold:
+                garbage_marker[i] = True
+    garbage = shots_df.assign(garbage=garbage_marker)['garbage']  # Aligned by index label, as in the old code
+    return tot_time, garbage
+
+
+def get_expected_garbage(shots_df):
+    """
+    Garbage-time rule evaluated on each row's own values: 4th quarter, lead of at least 13 + minutes remaining
+    """
+    rem_mins = shots_df["remaining_time"].str.split(":").str[1].astype(int)
+    return (shots_df["period"] == 4) & (shots_df["score_diff"] >= 13 + rem_mins)
+
+
+def check_range_index(n_rows=5000):
+    shots_df = dataproc.process_shots_df(make_log_df(n_rows))
+    assert shots_df.index.equals(pd.RangeIndex(n_rows))  # Every row is a valid shot
+    ref_tot_time, ref_garbage = ref_time_cols(shots_df)
+    np.testing.assert_array_equal(shots_df["tot_time"].values, np.array(ref_tot_time))
+    np.testing.assert_array_equal(shots_df["garbage"].values, ref_garbage.fillna(False).astype(bool).values)
+    print(f"Range index OK - tot_time & garbage identical to the loop version over {len(shots_df)} shots")
+
+
+def check_index_alignment(n_rows=5000):
+    # Non-shot rows are dropped by process_shots_df, so the shots keep a gappy index; then shuffle it as well
+    log_df = make_log_df(n_rows, seed=1, non_shot_frac=0.3)
+    log_df = log_df.sample(frac=1, random_state=0)
+    shots_df = dataproc.process_shots_df(log_df.copy())
+    assert not shots_df.index.is_monotonic_increasing
+
+    # Same rows, same order, fresh RangeIndex
+    reset_df = dataproc.process_shots_df(log_df.reset_index(drop=True).copy())
+    np.testing.assert_array_equal(shots_df["garbage"].values, reset_df["garbage"].values)
+    np.testing.assert_array_equal(shots_df["garbage"].values, get_expected_garbage(shots_df).values)
+    np.testing.assert_array_equal(shots_df["tot_time"].values, reset_df["tot_time"].values)
+
+    assert shots_df["garbage"].dtype == bool
+
+    # The loop version's marker only covers labels 0..len - 1, so rows labelled beyond that come back NaN
+    _, ref_garbage = ref_time_cols(shots_df)
+    print(f"Index alignment OK - garbage follows its rows on a shuffled, gappy index "
+          f"({int(shots_df['garbage'].sum())} of {len(shots_df)} flagged; "
+          f"the loop version gave an {ref_garbage.dtype} column with {int(ref_garbage.isna().sum())} NaN flags)")
+
+
+def bench(n_rows):
+    log_df = make_log_df(n_rows, seed=2)
+
+    t0 = time.perf_counter()
+    shots_df = dataproc.process_shots_df(log_df.copy())
+    t_new = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    ref_time_cols(shots_df)
+    t_loops = time.perf_counter() - t0
+
+    print(f"Benchmark - {n_rows} shots: process_shots_df {t_new:.2f}s; the old tot_time & garbage loops alone {t_loops:.2f}s")
+
+
+def main():
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    check_range_index()
+    check_index_alignment()
+    bench(n_rows)
+
+
+if __name__ == "__main__":
+    main()
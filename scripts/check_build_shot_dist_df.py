@@ -0,0 +1,198 @@
+# ========== (c) JP Hwang 18/10/2026  ==========
+# Compare dataproc.build_shot_dist_df against the previous per-player / per-minute filtering implementation
+# on small synthetic shot fixtures - including 'Others' consolidation and a player traded between teams.
+# Run from the repo root: python scripts/check_build_shot_dist_df.py [n_shots]
+
+import logging
+import os
+import sys
+import time
+import warnings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import numpy as np
+import pandas as pd
+import dataproc
+
+logger = logging.getLogger(__name__)
+root_logger = logging.getLogger()
+root_logger.setLevel(logging.WARNING)
+sh = logging.StreamHandler()
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+sh.setFormatter(formatter)
+root_logger.addHandler(sh)
+warnings.simplefilter("ignore", pd.errors.SettingWithCopyWarning)  # Raised by the previous implementation
+
+traded_player = "Traded Player"
+
+
+def make_shots_df(n_shots, n_teams=6, seed=0):
+    """
+    Synthetic shots with the columns used by build_shot_dist_df
+    :param n_shots: Number of shots
+    :param n_teams: Number of teams, each with a 12-man roster of uneven shot shares
+    :param seed: Random seed
+    :return: DataFrame
+    """
+    rng = np.random.default_rng(seed)
+    teams = [f"T{i:02d}" for i in range(n_teams)]
+    pl_weights = np.array([30, 25, 20, 15, 12, 10, 8, 6, 2, 1, 0.5, 0.2])
+    pl_weights = pl_weights / pl_weights.sum()
+
+    team = rng.choice(teams, n_shots)
+    roster_no = rng.choice(len(pl_weights), n_shots, p=pl_weights)
+    player = np.array([f"P{tm}_{no}" for tm, no in zip(team, roster_no)], dtype=object)
+    # One leading player who shoots for the first team, then the second
+    traded = (roster_no == 0) & np.isin(team, teams[:2])
+    player[traded] = traded_player
+
+    period = rng.choice([1, 2, 3, 4, 5], n_shots, p=[.24, .24, .24, .24, .04])
+    tot_time = np.where(period < 5, (period - 1) * 12 + rng.integers(0, 12, n_shots) + (1 - rng.integers(0, 60, n_shots) / 60),
+                        48 + rng.random(n_shots) * 5)
+    return pd.DataFrame({
+        "player": player, "team": team, "period": period, "tot_time": tot_time,
+        "garbage": rng.random(n_shots) < 0.03, "shot_made": rng.integers(0, 2, n_shots),
+        "is_three": rng.random(n_shots) < 0.35, "game_id": rng.integers(1, 200, n_shots),
+    })
+
+
+def ref_build_shot_dist_df(shots_df):
+    """
+    Previous implementation of build_shot_dist_df (without writing an output file), for comparison
+    """
+    # ========== PROCESS DATA FILE ==========
+    shots_df.reset_index(inplace=True, drop=True)
+    shots_df = shots_df[shots_df.period <= 4]
+
+    # Get non-garbage time minutes:  Rule: up 13 with a minute left, increasing by one each minute
+    shots_df = shots_df[shots_df["garbage"] == False]
+
+    player_counts = dataproc.get_pl_shot_counts(shots_df, crunchtime_mins=5)  # Sort by crunchtime shots, not just overall
+
+    # Get top players for the summary list
+    teams_list = set()
+    top_players = list()
+    for (player, pl_team) in player_counts.index[::-1]:
+        if pl_team not in teams_list:
+            top_players.append([player, pl_team])
+            teams_list.add(pl_team)
+    top_players = top_players[::-1]
+
+    summary_data_list = list()
+
+    # Get player data
+    pl_acc_dict = dict()  # accuracies
+    pl_pps_dict = dict()  # points per shot
+
+    for player in shots_df.player.unique():
+        pl_q_acc_dict = dict()
+        pl_q_pps_dict = dict()
+        for period in shots_df.period.unique():
+            pl_df = shots_df[(shots_df.player == player) & (shots_df.period == period)]
+            # Are there are any shots?
+            if len(pl_df) > 0:
+                pl_q_acc_dict[period] = sum(pl_df.shot_made) / len(pl_df.shot_made)
+                pl_q_pps_dict[period] = (
+                        (3 * sum(pl_df[pl_df.is_three].shot_made) + 2 * sum(pl_df[pl_df.is_three == False].shot_made))
+                        / len(pl_df.shot_made)
+                )
+            else:
+                pl_q_acc_dict[period] = 0
+                pl_q_pps_dict[period] = 0
+
+        pl_acc_dict[player] = pl_q_acc_dict
+        pl_pps_dict[player] = pl_q_pps_dict
+
+    # Set up range (number of minutes)
+    min_range = 1
+
+    for min_start in range(0, 48, min_range):
+        min_end = min_start + min_range
+        time_df = shots_df[(shots_df.tot_time > min_start) & (shots_df.tot_time <= min_end)]
+
+        for player, team in top_players:
+            pl_dict = dataproc.get_pl_data_dict(time_df, player, team, pl_acc_dict, pl_pps_dict, min_start, min_end)
+            summary_data_list.append(pl_dict)
+
+    summary_df = pd.DataFrame(summary_data_list)
+    summary_df = summary_df.assign(group="Leaders")
+
+    part_thresh = 1  # Minimum % of team's shots to be shown on the chart
+    # For each team:
+    team_dfs = list()
+    for team in shots_df.team.unique():
+
+        team_df = shots_df[shots_df.team == team]
+        player_counts = team_df.groupby('player').count()['game_id'].sort_values(ascending=True)
+
+        # Consolidate non-qualifying players to 'Others'
+        others_counts = player_counts[player_counts < sum(player_counts) / 100 * part_thresh]
+        for temp_name in list(others_counts.index):
+            team_df.player.replace(temp_name, 'Others', inplace=True)
+
+        player_counts = dataproc.get_pl_shot_counts(team_df, crunchtime_mins=5)  # Sort by crunchtime shots, not just overall
+
+        # Get data for 'Others' as an aggreagate
+        others_df = team_df[team_df.player == 'Others']
+        pl_q_acc_dict = dict()
+        pl_q_pps_dict = dict()
+        for period in shots_df.period.unique():
+            if len(others_df) > 0:
+                pl_q_acc_dict[period] = sum(others_df.shot_made) / len(others_df.shot_made)
+                pl_q_pps_dict[period] = (
+                        (3 * sum(others_df[others_df.is_three].shot_made) + 2 * sum(others_df[others_df.is_three == False].shot_made))
+                        / len(others_df.shot_made)
+                )
+            else:
+                pl_q_acc_dict[period] = 0
+                pl_q_pps_dict[period] = 0
+        pl_acc_dict['Others'] = pl_q_acc_dict
+        pl_pps_dict['Others'] = pl_q_pps_dict
+
+        team_summary_data_list = list()
+        min_range = 1
+
+        for min_start in range(0, 48, min_range):
+            min_end = min_start + min_range
+            time_df = team_df[(team_df.tot_time > min_start) & (team_df.tot_time <= min_end)]
+
+            for player, team in player_counts.index:
+                pl_dict = dataproc.get_pl_data_dict(time_df, player, team, pl_acc_dict, pl_pps_dict, min_start, min_end, add_teamname=False)
+                team_summary_data_list.append(pl_dict)
+
+        team_summary_df = pd.DataFrame(team_summary_data_list)
+        team_summary_df = team_summary_df.assign(group=team)
+        team_dfs.append(team_summary_df)
+
+        # ===== END - COMPILE PLAYER DATA =====
+
+    shot_dist_df = pd.concat(team_dfs + [summary_df])
+
+    return shot_dist_df
+
+
+def check_equal(shots_df, label, check_others=True):
+    t0 = time.perf_counter()
+    ref_df = ref_build_shot_dist_df(shots_df.copy())
+    t_ref = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    shot_dist_df = dataproc.build_shot_dist_df(shots_df.copy(), outfile=None)
+    t_new = time.perf_counter() - t0
+
+    pd.testing.assert_frame_equal(ref_df, shot_dist_df, check_exact=True)
+    if check_others:
+        assert (shot_dist_df["player"] == "Others").any()
+    n_traded_groups = shot_dist_df.loc[shot_dist_df["player"] == traded_player, "group"].nunique()
+    assert n_traded_groups == 2, f"{traded_player} found in {n_traded_groups} team groups"
+    print(f"{label} OK - {len(shot_dist_df)} rows identical to the previous implementation "
+          f"(previous {t_ref:.2f}s, current {t_new:.2f}s)")
+
+
+def main():
+    n_shots = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    check_equal(make_shots_df(500, n_teams=3, seed=1), "Small fixture", check_others=False)
+    check_equal(make_shots_df(n_shots), f"{n_shots} shots")
+
+
+if __name__ == "__main__":
+    main()
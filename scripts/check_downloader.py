@@ -0,0 +1,138 @@
+# ========== (c) JP Hwang 18/10/2026  ==========
+# Check the concurrent game data downloader (update_data.update_gamedata) against a local stub HTTP server:
+# retries with exponential backoff on failed requests, the token-bucket rate limit, and manifest-based skipping.
+# Run from the repo root: python scripts/check_downloader.py
+
+import logging
+import os
+import sys
+import json
+import time
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pandas as pd
+import utils
+import update_data
+
+logger = logging.getLogger(__name__)
+root_logger = logging.getLogger()
+root_logger.setLevel(logging.WARNING)
+sh = logging.StreamHandler()
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+sh.setFormatter(formatter)
+root_logger.addHandler(sh)
+logging.getLogger("utils").setLevel(logging.CRITICAL)  # Deliberate failures would log a traceback each
+
+season_yr = 2021
+n_games = 24
+gm_ids = [f"00221{i:05d}" for i in range(1, n_games + 1)]
+fail_counts = {gm_ids[2]: 1, gm_ids[5]: 2, gm_ids[11]: 2}  # Games that fail this many times before succeeding
+always_fail = gm_ids[7]
+workers = 4
+rate_limit = 10  # Requests per second - the default burst capacity is the same, so later requests are throttled
+max_retries = 3
+backoff = 0.05
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Serves /<datatype>/<gm_id> as JSON, failing with a 500 for the configured games
+    """
+    requests = list()  # (time, gm_id, status)
+    lock = threading.Lock()
+
+    def do_GET(self):
+        _, datatype, gm_id = self.path.split("/")
+        with self.lock:
+            n_prev = sum(1 for r in self.requests if r[1] == gm_id)
+            fail = gm_id == always_fail or n_prev < fail_counts.get(gm_id, 0)
+            self.requests.append((time.monotonic(), gm_id, 500 if fail else 200))
+        if fail:
+            self.send_error(500, "Deliberate failure")
+            return
+        body = json.dumps({"game": {"gameId": gm_id, "datatype": datatype, "actions": []}}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def get_http_content_func(base_url):
+    """
+    Content function for fetch_data_w_gameid that downloads from the stub server
+    """
+    from urllib.request import urlopen
+
+    def content_func(gm_id, datatype):
+        with urlopen(f"{base_url}/{datatype}/{gm_id}", timeout=5) as response:
+            return json.loads(response.read())
+    return content_func
+
+
+def main():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    content_func = get_http_content_func(f"http://127.0.0.1:{server.server_address[1]}")
+
+    orig_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.chdir(tmp_dir)  # Manifest & game logs are read from / written to relative paths
+        try:
+            os.makedirs(utils.dl_dir)
+            fname = utils.get_fname('tm_gamelogs', utils.year_to_season_suffix(season_yr), "Regular Season")
+            pd.DataFrame({"GAME_ID": gm_ids, "GAME_DATE": "2021-10-19"}).to_csv(os.path.join(utils.dl_dir, fname), index=False)
+            json_dir = os.path.join(utils.dl_dir, "stub", "json")
+
+            update_data.update_gamedata(json_dir, "pbp", st_year=season_yr, end_year=season_yr, workers=workers,
+                                        rate_limit=rate_limit, max_retries=max_retries, backoff=backoff, content_func=content_func)
+            reqs = pd.DataFrame(StubHandler.requests, columns=["time", "gm_id", "status"]).sort_values("time")
+
+            # Retries - each game is requested until it succeeds, or max_retries + 1 times
+            n_reqs = reqs.groupby("gm_id").size()
+            for gm_id in gm_ids:
+                exp_reqs = max_retries + 1 if gm_id == always_fail else fail_counts.get(gm_id, 0) + 1
+                assert n_reqs[gm_id] == exp_reqs, f"{gm_id}: {n_reqs[gm_id]} requests, expected {exp_reqs}"
+            saved = {f[:-len(".json")] for f in os.listdir(json_dir)}
+            assert saved == set(gm_ids) - {always_fail}, f"Saved files: {sorted(saved)}"
+            print(f"Retries OK - {len(reqs)} requests, {len(saved)} of {n_games} games saved")
+
+            # Backoff - waits of backoff, 2 x backoff, ... between attempts for the same game
+            for gm_id in [always_fail] + list(fail_counts.keys()):
+                gaps = reqs.loc[reqs["gm_id"] == gm_id, "time"].diff().dropna().values
+                min_gaps = [backoff * (2 ** i) for i in range(len(gaps))]
+                assert all(gap >= min_gap for gap, min_gap in zip(gaps, min_gaps)), f"{gm_id}: gaps {gaps}, expected >= {min_gaps}"
+            print(f"Backoff OK - gaps for {always_fail}: {reqs.loc[reqs['gm_id'] == always_fail, 'time'].diff().dropna().round(3).tolist()}")
+
+            # Rate limit - any run of requests stays within the bucket capacity plus refills over its timespan
+            capacity = max(1.0, rate_limit)
+            times = reqs["time"].values
+            tol = 0.01  # Seconds - allows for the time between taking a token and the request arriving
+            for i in range(len(times)):
+                for j in range(i, len(times)):
+                    allowed = capacity + rate_limit * (times[j] - times[i] + tol)
+                    assert j - i + 1 <= allowed, f"{j - i + 1} requests in {times[j] - times[i]:.3f}s (allowed {allowed:.1f})"
+            min_duration = (len(times) - capacity) / rate_limit
+            assert times[-1] - times[0] >= min_duration - tol, f"{len(times)} requests in {times[-1] - times[0]:.2f}s, expected >= {min_duration:.2f}s"
+            print(f"Rate limit OK - {len(times)} requests over {times[-1] - times[0]:.2f}s at {rate_limit}/s (burst {capacity:.0f})")
+
+            # Manifest - a rerun only requests the game that has not been saved
+            n_before = len(StubHandler.requests)
+            update_data.update_gamedata(json_dir, "pbp", st_year=season_yr, end_year=season_yr, workers=workers,
+                                        rate_limit=rate_limit, max_retries=0, backoff=backoff, content_func=content_func)
+            rerun_ids = {r[1] for r in StubHandler.requests[n_before:]}
+            assert rerun_ids == {always_fail}, f"Rerun requested {sorted(rerun_ids)}"
+            print("Manifest OK - rerun only requested the missing game")
+        finally:
+            os.chdir(orig_dir)
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -15,6 +15,9 @@ pd.set_option("display.max_columns", 20)
 pd.set_option("display.width", desired_width)
 
 dl_dir = utils.dl_dir
+dl_workers = 4  # Concurrent game data downloads
+dl_rate_limit = 2.0  # Max requests per second to the NBA endpoints, across all download workers
+proc_workers = 4  # Processes for parsing & processing PBP data
 
 
 def fetch_pl_list(season_suffix):
@@ -130,23 +133,49 @@ def update_season_pl_gamelogs():
     return True
 
 
-def update_gamedata(json_dir, datatype, st_year=None, end_year=None):
+def update_gamedata(json_dir, datatype, st_year=None, end_year=None, workers=1, rate_limit=None, max_retries=3,
+                    backoff=2.0, content_func=None):
     """
     Download availble game-based data from NBA API
     :param json_dir: Directory to save downloads to
-    :param season_type: Regular season or the Playoffs?
+    :param datatype: What data types to download - 'boxscore' or 'pbp'
+    :param st_year: Year to download data from
+    :param end_year: Year to download data to
+    :param workers: Number of concurrent download threads
+    :param rate_limit: Max API requests per second across all workers (None for no limit)
+    :param max_retries: Number of retries per game after the first attempt
+    :param backoff: Base wait time in seconds between retries - doubles after each failed attempt
+    :param content_func: Function (gm_id, datatype) returning the content; defaults to the NBA API
     :return:
     """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
     logger.info(f"Starting download of game {datatype} data...")
     gldf = utils.load_tm_gamelogs(st_year=st_year, end_year=end_year, season_types=None)
     gldf = gldf.sort_values("gamedate_dt")
     gm_ids = gldf["GAME_ID"].unique()
 
+    # Only dispatch games without a valid download; corrupt/partial files get fetched again
+    manifest = utils.sync_manifest(json_dir, datatype)
+    todo_ids = [gm_id for gm_id in gm_ids if manifest.get(utils.norm_gm_id(gm_id), {}).get("parse_status") != "ok"]
+    logger.info(f"{len(gm_ids) - len(todo_ids)} of {len(gm_ids)} games already downloaded per manifest.")
+
+    rate_limiter = utils.TokenBucket(rate_limit) if rate_limit is not None else None
+    dl_kwargs = dict(datatype=datatype, max_retries=max_retries, backoff=backoff, rate_limiter=rate_limiter,
+                     content_func=content_func, manifest=manifest)
+
     err_counter = 0
-    for gm_id in gm_ids[::-1]:
-        dl_succ = utils.fetch_data_w_gameid(json_dir, gm_id, datatype=datatype)
-        if dl_succ is False:
-            err_counter += 1
+    if workers <= 1:
+        for gm_id in todo_ids[::-1]:
+            dl_succ = utils.fetch_data_w_retry(json_dir, gm_id, **dl_kwargs)
+            if dl_succ is False:
+                err_counter += 1
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(utils.fetch_data_w_retry, json_dir, gm_id, **dl_kwargs) for gm_id in todo_ids[::-1]]
+            for future in as_completed(futures):
+                if future.result() is False:
+                    err_counter += 1
     logger.info(f"Finished downloading game {datatype} data between {st_year} and {end_year} seasons. {err_counter} errors encountered out of {len(gm_ids)}.")
 
     return True
@@ -183,32 +212,224 @@ def get_season_gamelogs(season_yr=None, season_type=None):
     return True
 
 
-def process_pbp_logs(st_year, end_year):
+def process_pbp_partition(part_df, starters, part_path):
+    """
+    Add on-court columns to one partition of a season's PBP data and save it - run in worker processes
+    :param part_df: PBP dataframe for a subset of games
+    :param starters: Starters lookup for the same games (see utils.load_starters_index)
+    :param part_path: Path to save the processed partition to
+    :return: part_path
+    """
+    proc_df = utils.add_pbp_oncourt_columns(part_df, starters=starters)
+    proc_df.to_pickle(part_path + ".tmp")
+    os.replace(part_path + ".tmp", part_path)
+    return part_path
+
+
+def process_pbp_games(df, starters, parts_dir, workers=1, partition_size=100):
+    """
+    Add on-court columns to PBP data, in partitions of games.
+    Partitions are processed (in parallel if workers > 1) and pickled individually to parts_dir,
+    so that an interrupted run resumes from the partitions already saved.
+    :param df: PBP dataframe
+    :param starters: Starters lookup (see utils.load_starters_index)
+    :param parts_dir: Directory to save processed partitions to
+    :param workers: Number of processes to use
+    :param partition_size: Number of games per partition
+    :return: Processed PBP dataframe
+    """
+    import hashlib
+    from concurrent.futures import ProcessPoolExecutor
+
+    # Partition by game, skipping any partitions saved by a previous (interrupted) run
+    os.makedirs(parts_dir, exist_ok=True)
+    gm_ids = sorted(df["GAME_ID"].unique())
+    starters_by_gm = dict()
+    for k, v in starters.items():
+        starters_by_gm.setdefault(k[0], dict())[k] = v
+    part_paths = list()
+    todo_parts = list()
+    for i in range(0, len(gm_ids), partition_size):
+        part_gm_ids = gm_ids[i:i + partition_size]
+        part_starters = {k: v for gm_id in part_gm_ids for k, v in starters_by_gm.get(gm_id, dict()).items()}
+        # Name partitions by their contents (games & starters), so that a saved partition is only reused for the same inputs
+        part_hash = hashlib.sha1(repr((part_gm_ids, sorted(part_starters.items()))).encode()).hexdigest()[:12]
+        part_path = os.path.join(parts_dir, f"{part_gm_ids[0]}_{part_gm_ids[-1]}_{part_hash}.pkl")
+        part_paths.append(part_path)
+        if os.path.exists(part_path):
+            logger.info(f"Found processed partition {part_path}, skipping.")
+        else:
+            todo_parts.append((
+                df[df["GAME_ID"].isin(part_gm_ids)],
+                part_starters,
+                part_path
+            ))
+
+    logger.info(f"Processing {len(todo_parts)} of {len(part_paths)} partitions in {parts_dir}")
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(process_pbp_partition, *part) for part in todo_parts]
+            for future in futures:
+                future.result()
+    else:
+        for part in todo_parts:
+            process_pbp_partition(*part)
+
+    oncourt_cols = [f"tm_{tm_i}_player{j + 1}" for tm_i in range(2) for j in range(5)]
+    if len(part_paths) == 0:
+        return df.assign(**{col: np.zeros(len(df), dtype=np.int64) for col in oncourt_cols})
+    proc_df = pd.concat([pd.read_pickle(part_path) for part_path in part_paths])
+    proc_df = proc_df[[c for c in df.columns if c in proc_df.columns] + oncourt_cols]
+    return proc_df
+
+
+def rollback_csv_append(fpath):
+    """
+    Undo an interrupted append_to_csv call, by truncating the file back to its size before the append
+    :param fpath: Path to CSV file
+    :return: True if an append was rolled back
+    """
+    marker_fpath = fpath + ".append"
+    if not os.path.exists(marker_fpath):
+        return False
+    with open(marker_fpath) as f:
+        orig_size = int(f.read())
+    logger.warning(f"Rolling back an interrupted append to {fpath}")
+    os.truncate(fpath, orig_size)
+    os.remove(marker_fpath)
+    return True
+
+
+def append_to_csv(df, fpath):
+    """
+    Append rows to an existing CSV file, in the file's column order.
+    The original file size is recorded in a marker file until the append completes,
+    so that an interrupted append can be rolled back (see rollback_csv_append).
+    :param df: DataFrame to append
+    :param fpath: Path to existing CSV file
+    :return: True if appended; False if df has columns that are not in the file
+    """
+    rollback_csv_append(fpath)
+    existing_cols = pd.read_csv(fpath, nrows=0).columns.tolist()
+    if not set(df.columns).issubset(existing_cols):
+        return False
+
+    marker_fpath = fpath + ".append"
+    with open(marker_fpath, "w") as f:
+        f.write(str(os.path.getsize(fpath)))
+    try:
+        df.reindex(columns=existing_cols).to_csv(fpath, mode="a", header=False, index=False)
+    except BaseException:
+        rollback_csv_append(fpath)
+        raise
+    os.remove(marker_fpath)
+    return True
+
+
+def append_new_games(df, starters, parts_dir, proc_df_fpath, shots_df_fpath, stints_df_fpath, workers=1, partition_size=100):
+    """
+    Process games missing from any of a season's saved outputs (proc, shots & stints CSVs), and append them.
+    Each file is checked separately, so that games are not treated as done because they are in one file only.
+    :param df: PBP dataframe for the season
+    :param starters: Starters lookup (see utils.load_starters_index)
+    :param parts_dir: Directory to save processed partitions to
+    :param proc_df_fpath: Path to processed PBP CSV
+    :param shots_df_fpath: Path to shots CSV
+    :param stints_df_fpath: Path to stints CSV - built from the processed PBP CSV if it does not exist
+    :param workers: Number of processes to use
+    :param partition_size: Number of games per partition (see process_pbp_games)
+    :return: True if the outputs were updated; False if the new games add columns, so the season needs a full rebuild
+    """
+    done_ids = dict()
+    for fpath in [proc_df_fpath, shots_df_fpath, stints_df_fpath]:
+        if os.path.exists(fpath):
+            rollback_csv_append(fpath)
+            done_ids[fpath] = set(pd.read_csv(fpath, usecols=["GAME_ID"], dtype={"GAME_ID": "str"})["GAME_ID"])
+
+    gm_ids = set(df["GAME_ID"].unique())
+    todo_ids = set().union(*[gm_ids - ids for ids in done_ids.values()])
+    logger.info(f"Found {len(todo_ids)} new or incomplete games in {proc_df_fpath}")
+
+    if len(todo_ids) > 0:
+        proc_df = process_pbp_games(df[df["GAME_ID"].isin(todo_ids)], starters, parts_dir, workers=workers, partition_size=partition_size)
+        if not append_to_csv(proc_df[~proc_df["GAME_ID"].isin(done_ids[proc_df_fpath])], proc_df_fpath):
+            return False
+
+        shots_df = utils.build_shots_df(proc_df)
+        if not append_to_csv(shots_df[~shots_df["GAME_ID"].isin(done_ids[shots_df_fpath])], shots_df_fpath):
+            logger.warning(f"Could not append to {shots_df_fpath} - rebuilding shots for the season")
+            shots_df = utils.build_shots_df(pd.read_csv(proc_df_fpath, dtype={"GAME_ID": "str"}))
+            shots_df.to_csv(shots_df_fpath, index=False)
+
+    if stints_df_fpath not in done_ids:
+        logger.info(f"Building stints from {proc_df_fpath}")
+        stints_df = utils.build_stints_df(pd.read_csv(proc_df_fpath, dtype={"GAME_ID": "str"}))
+        stints_df.to_csv(stints_df_fpath, index=False)
+    elif len(todo_ids) > 0:
+        stints_df = utils.build_stints_df(proc_df)
+        if not append_to_csv(stints_df[~stints_df["GAME_ID"].isin(done_ids[stints_df_fpath])], stints_df_fpath):
+            logger.warning(f"Could not append to {stints_df_fpath} - rebuilding stints for the season")
+            stints_df = utils.build_stints_df(pd.read_csv(proc_df_fpath, dtype={"GAME_ID": "str"}))
+            stints_df.to_csv(stints_df_fpath, index=False)
+    return True
+
+
+def process_pbp_logs(st_year, end_year, workers=1, partition_size=100, incremental=False):
     """
     Process all existing pbp data and save to file
     :param st_year:
     :param end_year:
+    :param workers: Number of processes to use
+    :param partition_size: Number of games per partition (see process_pbp_games)
+    :param incremental: Only process games not already in the saved outputs, and append them to the files.
+        Falls back to a full rebuild if the new games have columns that the saved files do not.
     :return:
     """
+    proc_df_dir = 'data/proc_data'
+    starters = utils.load_starters_index(workers=workers)
 
     for yr in range(st_year, end_year + 1):
         for season_type in utils.def_season_types:
-            df = utils.load_pbp_jsons(st_year=yr, end_year=yr, season_types=[season_type])
+            df = utils.load_pbp_jsons(st_year=yr, end_year=yr, season_types=[season_type], workers=workers)
             df = df.assign(season_type=season_type)
-            proc_df = utils.add_pbp_oncourt_columns(df)
             season_suffix = utils.year_to_season_suffix(yr)
 
-            # Get proc_df
             proc_df_fname = utils.get_fname('proc_pbp', season_suffix, season_type)
-            proc_df_dir = 'data/proc_data'
             proc_df_fpath = os.path.join(proc_df_dir, proc_df_fname)
-            proc_df.to_csv(proc_df_fpath, index=False)
-
-            # Get shots_df
-            shots_df = utils.build_shots_df(proc_df)
             shots_df_fname = utils.get_fname('shots_pbp', season_suffix, season_type)
             shots_df_fpath = os.path.join(proc_df_dir, shots_df_fname)
-            shots_df.to_csv(shots_df_fpath, index=False)
+            stints_df_fpath = os.path.join(proc_df_dir, utils.get_fname('stints', season_suffix, season_type))
+            parts_dir = os.path.join(proc_df_dir, "parts", os.path.splitext(proc_df_fname)[0])
+
+            full_rebuild = True
+            if incremental and os.path.exists(proc_df_fpath) and os.path.exists(shots_df_fpath):
+                full_rebuild = not append_new_games(df, starters, parts_dir, proc_df_fpath, shots_df_fpath, stints_df_fpath,
+                                                    workers=workers, partition_size=partition_size)
+                if full_rebuild:
+                    logger.warning(f"New games for {season_suffix} {season_type} add new columns - rebuilding the season")
+
+            if full_rebuild:
+                # Files are rewritten in full - any markers of interrupted appends no longer apply
+                for fpath in [proc_df_fpath, shots_df_fpath, stints_df_fpath]:
+                    if os.path.exists(fpath + ".append"):
+                        os.remove(fpath + ".append")
+
+                # Get proc_df
+                proc_df = process_pbp_games(df, starters, parts_dir, workers=workers, partition_size=partition_size)
+                proc_df.to_csv(proc_df_fpath, index=False)
+
+                # Get shots_df
+                shots_df = utils.build_shots_df(proc_df)
+                shots_df.to_csv(shots_df_fpath, index=False)
+
+                # Get stints_df
+                stints_df = utils.build_stints_df(proc_df)
+                stints_df.to_csv(stints_df_fpath, index=False)
+
+            # Season outputs saved - partitions (incl. any from an older partitioning) no longer needed
+            if os.path.isdir(parts_dir):
+                for part_fname in os.listdir(parts_dir):
+                    os.remove(os.path.join(parts_dir, part_fname))
 
     return True
 
@@ -241,11 +462,13 @@ def main():
             get_season_gamelogs(season_yr=season_yr, season_type=season_type)
 
         # Download PbP data & Box score data
-        update_gamedata(json_dir="dl_data/box_scores/json", datatype="boxscore", st_year=season_yr, end_year=season_yr)
-        update_gamedata(json_dir="dl_data/pbp/json", datatype="pbp", st_year=season_yr, end_year=season_yr)
+        update_gamedata(json_dir=utils.box_json_dir, datatype="boxscore", st_year=season_yr, end_year=season_yr,
+                        workers=dl_workers, rate_limit=dl_rate_limit)
+        update_gamedata(json_dir=utils.pbp_json_dir, datatype="pbp", st_year=season_yr, end_year=season_yr,
+                        workers=dl_workers, rate_limit=dl_rate_limit)
 
         # Compile PbP data and save them by group
-        process_pbp_logs(st_year=season_yr, end_year=season_yr)
+        process_pbp_logs(st_year=season_yr, end_year=season_yr, workers=proc_workers, incremental=True)
 
 
 if __name__ == "__main__":
@@ -5,18 +5,33 @@ import numpy as np
 import os
 import logging
 import json
+import threading
+import time
+from collections import OrderedDict
 
 logger = logging.getLogger(__name__)
 
 # Parameters
 file_prefixes = {"pl_list": "common_all_players", "pl_gamelogs": "pl_gamelogs", "tm_gamelogs": "tm_gamelogs",
-                 "proc_pbp": "proc_pbp", "shots_pbp": "shots_pbp"}
+                 "proc_pbp": "proc_pbp", "shots_pbp": "shots_pbp", "pbp_cache": "pbp", "stints": "stints"}
 dl_dir = "dl_data"
+box_json_dir = "dl_data/box_scores/json"
+pbp_json_dir = "dl_data/pbp/json"
+pbp_cache_dir = "dl_data/pbp/parquet"  # Per-season Parquet cache of parsed PBP JSON
+starters_index_path = "dl_data/box_scores/starters.csv"  # Starting lineups by game & team, from box scores
+manifest_path = os.path.join(dl_dir, "manifest.sqlite")  # Index of downloaded game files
+_manifest_lock = threading.Lock()
 
 logfile_prefix = "dl_log_"
 def_start_year = 2015  # Default start year for multi-year based functions
 def_shots_df_loc = "data/proc_data/shots_pbp.csv"
 def_season_types = ["Regular Season", "Playoffs"]
+ref_profile_dir = "data/proc_data/ref_profiles"  # Disk cache of reference (league-wide) shot profiles
+ref_profile_cache_size = 32
+_ref_profile_cache = OrderedDict()  # LRU of reference shot profiles
+stint_player_cols = [f"player{j + 1}" for j in range(5)]
+stint_stat_cols = ["duration", "pts_for", "pts_against", "fga_for", "fgm_for", "fg3a_for", "fg3m_for", "fta_for", "ftm_for",
+                   "fga_against", "fgm_against", "fg3a_against", "fg3m_against", "fta_against", "ftm_against"]
 
 
 def year_to_season_suffix(season_yr):
@@ -149,53 +164,282 @@ def json_to_df(content):
         return None
 
 
+def norm_gm_id(gm_id):
+    """
+    Normalise a game ID to the 10-character string form used by the API (e.g. 22100001 -> '0022100001')
+    :param gm_id: NBA game ID as int or str
+    :return: Game ID as string
+    """
+    gm_id = str(gm_id)
+    if gm_id[:2] != '00':
+        gm_id = '00' + gm_id
+    return gm_id
+
+
 def get_json_path(json_dir, gm_id):
-    if str(gm_id)[:2] != '00':
-        gm_id = '00' + str(gm_id)
-    json_path = os.path.join(json_dir, gm_id + ".json")
+    json_path = os.path.join(json_dir, norm_gm_id(gm_id) + ".json")
     return json_path
 
 
-def fetch_data_w_gameid(json_dir, gm_id, datatype="boxscore"):
+def get_manifest_conn(db_path=None):
+    """
+    Open a connection to the download manifest, creating it if needed
+    :param db_path: Path to the SQLite manifest file
+    :return: sqlite3 connection
+    """
+    import sqlite3
+
+    if db_path is None:
+        db_path = manifest_path
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS downloads (
+            game_id TEXT NOT NULL,
+            datatype TEXT NOT NULL,
+            json_path TEXT NOT NULL,
+            n_bytes INTEGER,
+            checksum TEXT,
+            downloaded_at TEXT,
+            parse_status TEXT,
+            PRIMARY KEY (game_id, datatype)
+        )
+    """)
+    return conn
+
+
+def check_json_file(json_path):
+    """
+    Read a downloaded JSON file and check that it parses
+    :param json_path: Path to JSON file
+    :return: Tuple of (parse_status, n_bytes, checksum)
+    """
+    import hashlib
+
+    with open(json_path, 'rb') as f:
+        raw = f.read()
+    try:
+        content = json.loads(raw)
+        parse_status = "ok" if type(content) == dict and len(content) > 0 else "empty"
+    except ValueError:
+        parse_status = "corrupt"
+    return parse_status, len(raw), hashlib.md5(raw).hexdigest()
+
+
+def record_manifest_entry(gm_id, datatype, json_path, parse_status=None, n_bytes=None, checksum=None, db_path=None):
+    """
+    Add or update a file's entry in the download manifest
+    :param gm_id: NBA game ID
+    :param datatype: 'boxscore' or 'pbp'
+    :param json_path: Path of the saved JSON
+    :param parse_status: 'ok', 'empty' or 'corrupt' - determined from the file if not supplied
+    :param n_bytes: File size - determined from the file if not supplied
+    :param checksum: MD5 of the file contents - determined from the file if not supplied
+    :param db_path: Path to the SQLite manifest file
+    :return: Manifest entry as dict
+    """
+    from datetime import datetime
+
+    if parse_status is None or n_bytes is None or checksum is None:
+        parse_status, n_bytes, checksum = check_json_file(json_path)
+    entry = dict(game_id=norm_gm_id(gm_id), datatype=datatype, json_path=json_path, n_bytes=n_bytes,
+                 checksum=checksum, downloaded_at=datetime.now().isoformat(timespec="seconds"),
+                 parse_status=parse_status)
+    with _manifest_lock:
+        conn = get_manifest_conn(db_path)
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO downloads VALUES "
+                "(:game_id, :datatype, :json_path, :n_bytes, :checksum, :downloaded_at, :parse_status)", entry
+            )
+        conn.close()
+    return entry
+
+
+def set_manifest_status(gm_id, datatype, parse_status, db_path=None):
+    """
+    Flag a manifest entry with a new parse status (e.g. if a file fails to load)
+    :param gm_id: NBA game ID
+    :param datatype: 'boxscore' or 'pbp'
+    :param parse_status: New parse status
+    :param db_path: Path to the SQLite manifest file
+    :return:
+    """
+    with _manifest_lock:
+        conn = get_manifest_conn(db_path)
+        with conn:
+            conn.execute("UPDATE downloads SET parse_status = ? WHERE game_id = ? AND datatype = ?",
+                         (parse_status, norm_gm_id(gm_id), datatype))
+        conn.close()
+    return True
+
+
+def load_manifest(datatype, db_path=None):
+    """
+    Load the download manifest for a data type
+    :param datatype: 'boxscore' or 'pbp'
+    :param db_path: Path to the SQLite manifest file
+    :return: Dict of manifest entries, keyed by game ID
+    """
+    conn = get_manifest_conn(db_path)
+    rows = conn.execute("SELECT * FROM downloads WHERE datatype = ?", (datatype,)).fetchall()
+    conn.close()
+    return {row["game_id"]: dict(row) for row in rows}
+
+
+def sync_manifest(json_dir, datatype, db_path=None):
+    """
+    Register any JSON files in json_dir that are not yet in the manifest (e.g. downloaded before it existed),
+    and drop entries whose files have been removed
+    :param json_dir: Directory of downloaded JSON
+    :param datatype: 'boxscore' or 'pbp'
+    :param db_path: Path to the SQLite manifest file
+    :return: Dict of manifest entries, keyed by game ID
+    """
+    manifest = load_manifest(datatype, db_path=db_path)
+    if not os.path.exists(json_dir):
+        return manifest
+
+    json_files = {i[:-len(".json")] for i in os.listdir(json_dir) if i.endswith(".json")}
+    for gm_id in json_files - set(manifest.keys()):
+        entry = record_manifest_entry(gm_id, datatype, os.path.join(json_dir, gm_id + ".json"), db_path=db_path)
+        if entry["parse_status"] != "ok":
+            logger.warning(f"{datatype} JSON for game {gm_id} is {entry['parse_status']}, flagged in manifest")
+        manifest[gm_id] = entry
+
+    missing_ids = [gm_id for gm_id, entry in manifest.items()
+                   if os.path.normpath(os.path.dirname(entry["json_path"])) == os.path.normpath(json_dir) and gm_id not in json_files]
+    if len(missing_ids) > 0:
+        logger.warning(f"{len(missing_ids)} {datatype} files in the manifest no longer exist; removing entries")
+        with _manifest_lock:
+            conn = get_manifest_conn(db_path)
+            with conn:
+                conn.executemany("DELETE FROM downloads WHERE game_id = ? AND datatype = ?",
+                                 [(gm_id, datatype) for gm_id in missing_ids])
+            conn.close()
+        for gm_id in missing_ids:
+            manifest.pop(gm_id)
+    return manifest
+
+
+def get_manifest(json_dir, datatype, db_path=None):
+    """
+    Load the manifest for a data type, only scanning json_dir if the manifest has no entries for it yet
+    :param json_dir: Directory of downloaded JSON
+    :param datatype: 'boxscore' or 'pbp'
+    :param db_path: Path to the SQLite manifest file
+    :return: Dict of manifest entries, keyed by game ID
+    """
+    manifest = load_manifest(datatype, db_path=db_path)
+    if len(manifest) == 0:
+        manifest = sync_manifest(json_dir, datatype, db_path=db_path)
+    return manifest
+
+
+def fetch_gameid_content(gm_id, datatype="boxscore"):
+    """
+    Get the raw content for a game from the NBA API
+    :param gm_id: NBA game ID
+    :param datatype: What data types to download - determines endpoint to use
+    :return: Content data returned by NBA API
+    """
+    from nba_api.stats.endpoints import boxscoreadvancedv2
+    from nba_api.live.nba.endpoints import playbyplay
+
+    if datatype == "boxscore":
+        response = boxscoreadvancedv2.BoxScoreAdvancedV2(game_id=gm_id)
+    elif datatype == "pbp":
+        response = playbyplay.PlayByPlay(gm_id)
+    else:
+        raise ValueError(f"No valid data type supplied: {datatype}")
+    return json.loads(response.get_json())
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket to limit the rate of API calls across download workers
+    """
+    def __init__(self, rate, capacity=None):
+        """
+        :param rate: Tokens (requests) added per second
+        :param capacity: Max tokens held at once, i.e. allowed burst size
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Block until a token is available, then consume it
+        :return:
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_time = (1 - self._tokens) / self.rate
+            time.sleep(wait_time)
+
+
+def fetch_data_w_gameid(json_dir, gm_id, datatype="boxscore", rate_limiter=None, content_func=None, manifest=None):
     """
     Download a datafile based on gameID as downloaded from NBA API & saves to file
     :param json_dir: Directory for saving downloaded JSON
     :param gm_id: NBA game ID
     :param datatype: What data types to download - determines endpoint to use
+    :param rate_limiter: TokenBucket shared between workers - acquired before each API call
+    :param content_func: Function (gm_id, datatype) returning the content; defaults to the NBA API
+    :param manifest: Preloaded manifest dict (see load_manifest) to check for existing downloads;
+        if None, the filesystem is checked instead
     :return:
     """
-    from nba_api.stats.endpoints import boxscoreadvancedv2
-    from nba_api.live.nba.endpoints import playbyplay
+    import hashlib
 
     if datatype not in ['boxscore', 'pbp']:
         logger.warning(f'Supplied datatype ({datatype}) not recognised; defaulting to box score.')
         datatype = 'boxscore'
 
-    if not os.path.exists(json_dir):
-        os.makedirs(json_dir)
+    if content_func is None:
+        content_func = fetch_gameid_content
+
+    os.makedirs(json_dir, exist_ok=True)
 
     json_path = get_json_path(json_dir, gm_id)
-    if os.path.exists(json_path):
+    if manifest is not None:
+        manifest_entry = manifest.get(norm_gm_id(gm_id))
+        already_saved = manifest_entry is not None and manifest_entry["parse_status"] == "ok"
+    else:
+        already_saved = os.path.exists(json_path)
+
+    if already_saved:
         logger.info(f"JSON found for game {gm_id}, skipping download.")
     else:
         try:
             logger.info(f"Downloading {datatype} data for game {gm_id}")
-            if datatype == "boxscore":
-                response = boxscoreadvancedv2.BoxScoreAdvancedV2(game_id=gm_id)
-            elif datatype == "pbp":
-                response = playbyplay.PlayByPlay(gm_id)
-            else:
-                logger.warning("Something is wrong, no valid data type supplied. Exiting")
-                return None
-
+            if rate_limiter is not None:
+                rate_limiter.acquire()
+            content = content_func(gm_id, datatype)
 
-            content = json.loads(response.get_json())
             if type(content) == dict:
-                with open(json_path, 'w') as f:
-                    json.dump(content, f)
-                logger.info(f"Got {datatype} data for game {gm_id}")
-            else:
+                # Write to a temp file first so that no partial files are left behind
+                raw = json.dumps(content).encode()
+                tmp_path = json_path + ".tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(raw)
+                os.replace(tmp_path, json_path)
+                record_manifest_entry(gm_id, datatype, json_path, parse_status="ok", n_bytes=len(raw),
+                                      checksum=hashlib.md5(raw).hexdigest())
                 logger.info(f"Saved {datatype} data for game {gm_id} at {json_path}")
+            else:
+                logger.warning(f"Unexpected {datatype} content for game {gm_id}, not saved")
+                return False
         except:
             logger.exception(f"Error getting {datatype} data for game {gm_id}")
             return False
@@ -203,6 +447,33 @@ def fetch_data_w_gameid(json_dir, gm_id, datatype="boxscore"):
     return True
 
 
+def fetch_data_w_retry(json_dir, gm_id, datatype="boxscore", max_retries=3, backoff=2.0, rate_limiter=None,
+                       content_func=None, manifest=None):
+    """
+    Download a game datafile, retrying with exponential backoff on failure
+    :param json_dir: Directory for saving downloaded JSON
+    :param gm_id: NBA game ID
+    :param datatype: What data types to download - determines endpoint to use
+    :param max_retries: Number of retries after the first attempt
+    :param backoff: Base wait time in seconds - doubles after each failed attempt
+    :param rate_limiter: TokenBucket shared between workers
+    :param content_func: Function (gm_id, datatype) returning the content; defaults to the NBA API
+    :param manifest: Preloaded manifest dict to check for existing downloads
+    :return: True if successful, False otherwise
+    """
+    for attempt in range(max_retries + 1):
+        if attempt > 0:
+            wait_time = backoff * (2 ** (attempt - 1))
+            logger.info(f"Retrying {datatype} download for game {gm_id} in {wait_time}s (attempt {attempt + 1})")
+            time.sleep(wait_time)
+        dl_succ = fetch_data_w_gameid(json_dir, gm_id, datatype=datatype, rate_limiter=rate_limiter,
+                                      content_func=content_func, manifest=manifest)
+        if dl_succ:
+            return True
+    logger.warning(f"Giving up on {datatype} data for game {gm_id} after {max_retries + 1} attempts")
+    return False
+
+
 def box_json_to_df(content, data=None):
     """
     Load individual box score JSON to dataframe
@@ -226,174 +497,834 @@ def box_json_to_df(content, data=None):
     return df
 
 
-def load_box_scores(data="team"):
+def load_json_files(json_paths, datatype="pbp", data=None):
+    """
+    Parse a list of game JSON files into one DataFrame - also used as the worker function for parallel loads
+    :param json_paths: List of JSON file paths
+    :param datatype: 'boxscore' or 'pbp'
+    :param data: For box scores - specify player or team level data
+    :return: Tuple of (DataFrame or None, list of paths that failed to load)
+    """
+    df_list = list()
+    failed_paths = list()
+    for json_path in json_paths:
+        try:
+            with open(json_path, 'r') as f:
+                content = json.load(f)
+            if datatype == "pbp":
+                tdf = pbp_json_to_df(content)
+            else:
+                tdf = box_json_to_df(content, data=data)
+        except:
+            logger.exception(f"Error loading {datatype} JSON at {json_path}")
+            failed_paths.append(json_path)
+            continue
+        df_list.append(tdf)
+    if len(df_list) == 0:
+        return None, failed_paths
+    return pd.concat(df_list), failed_paths
+
+
+def read_game_jsons(gm_ids, manifest, datatype="pbp", data=None, workers=1):
+    """
+    Read game JSON files, skipping any missing or flagged in the manifest
+    :param gm_ids: List of game IDs
+    :param manifest: Manifest dict (see get_manifest)
+    :param datatype: 'boxscore' or 'pbp'
+    :param data: For box scores - specify player or team level data
+    :param workers: Number of processes to parse files with; files are split into ordered chunks
+    :return: DataFrame, or None if no games were loaded
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    json_paths = list()
+    for gm_id in gm_ids:
+        entry = manifest.get(norm_gm_id(gm_id))
+        if entry is None:
+            logger.warning(f"No {datatype} JSON downloaded for game {gm_id}, skipping.")
+        elif entry["parse_status"] != "ok":
+            logger.warning(f"{datatype} JSON for game {gm_id} is flagged as {entry['parse_status']}, skipping.")
+        else:
+            json_paths.append(entry["json_path"])
+
+    if workers > 1 and len(json_paths) > workers:
+        # A few chunks per worker to even out the load; results are concatenated in order
+        chunk_size = -(-len(json_paths) // (workers * 4))
+        chunks = [json_paths[i:i + chunk_size] for i in range(0, len(json_paths), chunk_size)]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(load_json_files, chunks, [datatype] * len(chunks), [data] * len(chunks)))
+    else:
+        results = [load_json_files(json_paths, datatype=datatype, data=data)]
+
+    df_list = [tdf for tdf, _ in results if tdf is not None]
+    for failed_path in [p for _, failed_paths in results for p in failed_paths]:
+        gm_id = os.path.splitext(os.path.basename(failed_path))[0]
+        logger.warning(f"Flagging {datatype} JSON for game {gm_id} as corrupt.")
+        set_manifest_status(gm_id, datatype, "corrupt")
+
+    if len(df_list) == 0:
+        return None
+    return pd.concat(df_list)
+
+
+def load_box_scores(data="team", workers=1):
     """
     Load all available box score data
     :param data: Specify player or team level data
+    :param workers: Number of processes to parse JSON files with
     :return: DataFrame of multiple game box scores
     """
-    json_dir = "dl_data/box_scores/json"
-    json_files = [i for i in os.listdir(json_dir) if i.endswith("json")]
+    manifest = get_manifest(box_json_dir, "boxscore")
+    df = read_game_jsons(sorted(manifest.keys()), manifest, datatype="boxscore", data=data, workers=workers)
+    return df
+
+
+def pbp_json_to_df(content):
+    """
+    Load individual PBP JSON to dataframe
+    :param content: Content data returned by NBA API
+    :return: DataFrame of single game PBP
+    """
+    df = pd.DataFrame(content['game']['actions'])
+    df["GAME_ID"] = content["game"]['gameId']
+    return df
+
+
+def get_season_gm_ids(season_yr, season_type):
+    """
+    Get game IDs for a season from the team game logs, in date order
+    :param season_yr: Season - year in integer (e.g. 2021 for 2021-22)
+    :param season_type: Season type (see def_season_types)
+    :return: List of game IDs
+    """
+    fpath = os.path.join(dl_dir, get_fname('tm_gamelogs', year_to_season_suffix(season_yr), season_type))
+    if not os.path.exists(fpath):
+        logger.warning(f"File not found at {fpath}")
+        return list()
+    gldf = pd.read_csv(fpath, usecols=["GAME_ID", "GAME_DATE"], dtype={"GAME_ID": "str"})
+    gldf = gldf.assign(gamedate_dt=pd.to_datetime(gldf["GAME_DATE"])).sort_values("gamedate_dt")
+    return [norm_gm_id(gm_id) for gm_id in gldf.GAME_ID.unique()]
+
+
+def get_pbp_cache_dir(season_suffix, season_type):
+    fname = get_fname('pbp_cache', season_suffix, season_type)
+    return os.path.join(pbp_cache_dir, os.path.splitext(fname)[0])
+
+
+def read_pbp_cache(cache_dir, columns=None):
+    """
+    Read cached PBP data for a season from its Parquet part files
+    :param cache_dir: Season cache directory (see get_pbp_cache_dir)
+    :param columns: Columns to read - None for all
+    :return: PBP dataframe, or None if nothing is cached
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if not os.path.exists(cache_dir):
+        return None
+    part_files = sorted([i for i in os.listdir(cache_dir) if i.endswith(".parquet")])
 
     df_list = list()
-    for json_file in json_files:
-        json_path = os.path.join(json_dir, json_file)
-        with open(json_path, 'r') as f:
-            content = json.load(f)
-        tdf = box_json_to_df(content, data=data)
+    for part_file in part_files:
+        part_path = os.path.join(cache_dir, part_file)
+        schema = pq.ParquetFile(part_path).schema_arrow
+        part_cols = schema.names if columns is None else [c for c in columns if c in schema.names]
+        tdf = pq.read_table(part_path, columns=part_cols).to_pandas()
+        # Nested fields (e.g. qualifiers) come back as arrays - convert back to lists as in the JSON
+        for field in schema:
+            if field.name in tdf.columns and pa.types.is_list(field.type):
+                tdf[field.name] = tdf[field.name].map(lambda v: v.tolist() if isinstance(v, np.ndarray) else v)
         df_list.append(tdf)
-    df = pd.concat(df_list)
-    return df
+    if len(df_list) == 0:
+        return None
+    return pd.concat(df_list)
+
+
+def update_pbp_cache(season_yr, season_type, gm_ids=None, manifest=None, workers=1):
+    """
+    Add any newly downloaded games for a season to its Parquet cache.
+    Each update writes a new part file, so existing parts are never rewritten.
+    :param season_yr: Season - year in integer (e.g. 2021 for 2021-22)
+    :param season_type: Season type (see def_season_types)
+    :param gm_ids: Game IDs for the season - read from the game logs if not supplied
+    :param manifest: Manifest dict (see get_manifest)
+    :param workers: Number of processes to parse new JSON files with
+    :return: Season cache directory
+    """
+    from datetime import datetime
+
+    if manifest is None:
+        manifest = get_manifest(pbp_json_dir, "pbp")
+
+    cache_dir = get_pbp_cache_dir(year_to_season_suffix(season_yr), season_type)
+    cached_df = read_pbp_cache(cache_dir, columns=["GAME_ID"])
+    cached_ids = set() if cached_df is None else set(cached_df["GAME_ID"].unique())
+
+    if gm_ids is None:
+        gm_ids = get_season_gm_ids(season_yr, season_type)
+    new_ids = [gm_id for gm_id in gm_ids
+               if gm_id not in cached_ids and manifest.get(gm_id, {}).get("parse_status") == "ok"]
+    if len(new_ids) == 0:
+        return cache_dir
+
+    logger.info(f"Adding {len(new_ids)} games to the PBP cache at {cache_dir}")
+    new_df = read_game_jsons(new_ids, manifest, datatype="pbp", workers=workers)
+    if new_df is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        part_path = os.path.join(cache_dir, f"part_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.parquet")
+        try:
+            new_df.to_parquet(part_path + ".tmp", index=False)
+            os.replace(part_path + ".tmp", part_path)
+        except:
+            logger.exception(f"Error writing PBP cache for {season_yr} {season_type}; games will be read from JSON")
+    return cache_dir
 
 
-def load_pbp_jsons(st_year=None, end_year=None, season_types=None):
+def load_pbp_jsons(st_year=None, end_year=None, season_types=None, columns=None, use_cache=True, workers=1):
     """
     Load PBP JSON data
     :param st_year: Year to load data from (e.g. 20 for 2020-21 season)
     :param end_year: Year to load data to (e.g. 21 for 2021-22 season)
     :param season_types: Season types (see def_season_types)
+    :param columns: Columns to load - None for all (only applied when reading from the cache)
+    :param use_cache: Read from (and update) the per-season Parquet cache rather than parsing every JSON
+    :param workers: Number of processes to parse JSON files with (for cold loads / cache updates)
     :return: JSON dataframe
     """
-    gldf = load_tm_gamelogs(st_year=st_year, end_year=end_year, season_types=season_types)
-    gldf = gldf.sort_values("gamedate_dt")
-
-    json_dir = "dl_data/pbp/json"
+    if season_types is None:
+        season_types = ["Regular Season", "Playoffs"]
+    if st_year is None:
+        st_year = def_start_year
+    if end_year is None:
+        end_year = curr_season_yr() + 1
+    if columns is not None and "GAME_ID" not in columns:
+        columns = ["GAME_ID"] + list(columns)
 
-    def pbp_json_to_df(content):
-        df = pd.DataFrame(content['game']['actions'])
-        df["GAME_ID"] = content["game"]['gameId']
-        return df
+    manifest = get_manifest(pbp_json_dir, "pbp")
 
     df_list = list()
-    for gm_id in gldf.GAME_ID.unique():
-        json_path = get_json_path(json_dir, gm_id)
-        with open(json_path, 'r') as f:
-            content = json.load(f)
-        tdf = pbp_json_to_df(content)
-        df_list.append(tdf)
+    for yr in range(st_year, end_year + 1):
+        for season_type in season_types:
+            gm_ids = get_season_gm_ids(yr, season_type)
+            if len(gm_ids) == 0:
+                continue
+            tdf = None
+            if use_cache:
+                cache_dir = update_pbp_cache(yr, season_type, gm_ids=gm_ids, manifest=manifest, workers=workers)
+                tdf = read_pbp_cache(cache_dir, columns=columns)
+                avail_ids = {gm_id for gm_id in gm_ids if manifest.get(gm_id, {}).get("parse_status") == "ok"}
+                if tdf is not None and not avail_ids.issubset(set(tdf["GAME_ID"].unique())):
+                    tdf = None  # Cache could not be updated - fall back to the JSON files
+                elif len(avail_ids) < len(gm_ids):
+                    logger.warning(f"{len(gm_ids) - len(avail_ids)} games missing or flagged in the manifest for {yr} {season_type}, skipping.")
+            if tdf is None:
+                tdf = read_game_jsons(gm_ids, manifest, datatype="pbp", workers=workers)
+                if tdf is None:
+                    continue
+            # Keep games in date order, as listed in the game logs
+            gm_order = {gm_id: i for i, gm_id in enumerate(gm_ids)}
+            tdf = tdf[tdf["GAME_ID"].isin(gm_order)]
+            tdf = tdf.iloc[np.argsort(tdf["GAME_ID"].map(gm_order).values, kind="stable")]
+            df_list.append(tdf)
     df = pd.concat(df_list)
 
-    df = df.assign(realtime_dt=pd.to_datetime(df["timeActual"]))
+    if "timeActual" in df.columns:
+        df = df.assign(realtime_dt=pd.to_datetime(df["timeActual"]))
     return df
 
 
-def add_pbp_oncourt_columns(df):
+def get_starters_df(box_df):
+    """
+    Get starters' rows from player box score data
+    :param box_df: Player box score DataFrame (see load_box_scores)
+    :return: DataFrame of GAME_ID, TEAM_ID, PLAYER_ID, in box score order
+    """
+    starters_df = box_df[box_df["START_POSITION"] != ""]
+    starters_df = starters_df.drop_duplicates(["GAME_ID", "TEAM_ID", "PLAYER_ID"])
+    return starters_df[["GAME_ID", "TEAM_ID", "PLAYER_ID"]]
+
+
+def get_starters(starters_df):
+    """
+    Build the starters lookup used for lineup reconstruction
+    :param starters_df: DataFrame of GAME_ID, TEAM_ID, PLAYER_ID (see get_starters_df)
+    :return: Dict of starter PLAYER_ID lists, keyed by (GAME_ID, TEAM_ID)
+    """
+    return {k: v.tolist() for k, v in starters_df.groupby(["GAME_ID", "TEAM_ID"], sort=False)["PLAYER_ID"]}
+
+
+def update_starters_index(workers=1):
+    """
+    Add starters from any newly downloaded box scores to the starters index saved with the box score data
+    :param workers: Number of processes to parse new box score JSON files with
+    :return: DataFrame of GAME_ID, TEAM_ID, PLAYER_ID
+    """
+    if os.path.exists(starters_index_path):
+        starters_df = pd.read_csv(starters_index_path, dtype={"GAME_ID": "str"})
+        indexed_ids = set(starters_df["GAME_ID"].unique())
+    else:
+        starters_df = None
+        indexed_ids = set()
+
+    manifest = get_manifest(box_json_dir, "boxscore")
+    new_ids = sorted([gm_id for gm_id, entry in manifest.items()
+                      if entry["parse_status"] == "ok" and gm_id not in indexed_ids])
+    if len(new_ids) > 0:
+        logger.info(f"Adding starters for {len(new_ids)} games to {starters_index_path}")
+        box_df = read_game_jsons(new_ids, manifest, datatype="boxscore", data="player", workers=workers)
+        if box_df is not None:
+            starters_df = pd.concat([starters_df, get_starters_df(box_df)])
+            starters_df.to_csv(starters_index_path + ".tmp", index=False)
+            os.replace(starters_index_path + ".tmp", starters_index_path)
+    return starters_df
+
+
+def load_starters_index(workers=1):
+    """
+    Load the starters index, updating it first with any new box scores
+    :param workers: Number of processes to parse new box score JSON files with
+    :return: Dict of starter PLAYER_ID lists, keyed by (GAME_ID, TEAM_ID)
+    """
+    starters_df = update_starters_index(workers=workers)
+    if starters_df is None:
+        return dict()
+    return get_starters(starters_df)
+
+
+def get_game_team_order(df):
+    """
+    Get the order in which teams first appear in each game's PBP data - determines the tm_{i} column prefixes
+    :param df: PBP dataframe, sorted by GAME_ID and actionNumber
+    :return: DataFrame of GAME_ID, teamId, tm_i
+    """
+    tm_order = df.loc[df["teamId"].notna(), ["GAME_ID", "teamId"]].drop_duplicates()
+    tm_order = tm_order.assign(tm_i=tm_order.groupby("GAME_ID").cumcount())
+    return tm_order[tm_order["tm_i"] < 2].reset_index(drop=True)
+
+
+def get_sub_pairs(df):
+    """
+    Pair up substitutions within each team-game. Subs are recorded as separate 'out' and 'in' actions -
+    the n-th player out is replaced by the n-th player in, taking effect at the later of the two actions.
+    :param df: PBP dataframe
+    :return: DataFrame of GAME_ID, teamId, actionNumber, personId_out, personId_in
+    """
+    subs_df = df.loc[df["actionType"] == "substitution", ["GAME_ID", "teamId", "actionNumber", "subType", "personId"]]
+    subs_df = subs_df.assign(is_out=subs_df["subType"] == "out")
+    subs_df = subs_df.assign(pair_n=subs_df.groupby(["GAME_ID", "teamId", "is_out"]).cumcount())
+
+    outs_df = subs_df[subs_df["is_out"]].drop(columns=["subType", "is_out"])
+    ins_df = subs_df[~subs_df["is_out"]].drop(columns=["subType", "is_out"])
+    pairs_df = outs_df.merge(ins_df, on=["GAME_ID", "teamId", "pair_n"], how="outer", suffixes=("_out", "_in"))
+
+    unpaired = pairs_df["personId_out"].isna() | pairs_df["personId_in"].isna()
+    for (gm_id, tm_id), tdf in pairs_df[unpaired].groupby(["GAME_ID", "teamId"]):
+        logger.warning(
+            f"Something went wrong parsing {gm_id} for {tm_id}! subin_buffer: {tdf['personId_in'].dropna().tolist()}, subout_buffer: {tdf['personId_out'].dropna().tolist()}")
+
+    pairs_df = pairs_df[~unpaired]
+    pairs_df = pairs_df.assign(actionNumber=np.maximum(pairs_df["actionNumber_out"], pairs_df["actionNumber_in"]))
+    pairs_df = pairs_df.sort_values(["GAME_ID", "teamId", "actionNumber"])
+    return pairs_df[["GAME_ID", "teamId", "actionNumber", "personId_out", "personId_in"]]
+
+
+def add_pbp_oncourt_columns(df, box_df=None, starters=None):
     """
     Add on-court player columns to the play-by-play dataframe.
     Players based on substitution data and box-score data (for starters)
+    Lineups are tracked per team-game through the substitutions only, recording a change-point at each one;
+    every action then takes the latest change-point at or before it.
     :param df: PBP dataframe
+    :param box_df: Player box score DataFrame to get starters from
+    :param starters: Starters lookup (see load_starters_index) - used instead of box_df if supplied;
+        loaded from the starters index if neither is supplied
     :return:
     """
     df = df.sort_values(["GAME_ID", "actionNumber"])
     df = df.reset_index(drop=True)
 
-    box_df = load_box_scores(data="player")
-
-    gm_dfs = list()
-    for gm_id in df["GAME_ID"].unique():
-        logger.info(f"Processing game {gm_id}")
-        gm_df = df[df["GAME_ID"] == gm_id]
-
-        tm_ids = [i for i in gm_df["teamId"].unique() if not np.isnan(i)]
-
-        for tm_i in range(2):
-            tm_id = tm_ids[tm_i]
-            tm_df = gm_df[gm_df["teamId"] == tm_id]
-
-            starter_list = box_df[
-                (box_df["TEAM_ID"] == tm_id) & (box_df["GAME_ID"] == gm_id) & (box_df["START_POSITION"] != "")
-                ]["PLAYER_ID"].unique().tolist()
-
-            for i in range(5):
-                tm_df.loc[:, "player" + str(i + 1)] = starter_list[i]
-
-            subout_buffer = list()
-            subin_buffer = list()
-            for row in tm_df.itertuples():
-                if row.actionType == "substitution":
-                    if row.subType == "out":
-                        subout_buffer.append(row.personId)
-                    else:
-                        subin_buffer.append(row.personId)
-
-                    if len(subin_buffer) > 0 and len(subout_buffer) > 0:
-                        subout = subout_buffer.pop(0)
-                        subin = subin_buffer.pop(0)
-                        for j in range(5):
-                            tmpcol = "player" + str(j + 1)
-                            if getattr(row, tmpcol) == subout:
-                                tm_df.loc[tm_df["actionNumber"] >= row.actionNumber, tmpcol] = subin
-
-            if len(subout_buffer) != 0 or len(subin_buffer) != 0:
-                logger.warning(
-                    f"Something went wrong parsing {gm_id} for {tm_id}! subin_buffer: {subin_buffer}, subout_buffer: {subout_buffer}")
-
-            tm_df.rename({"player" + str(j + 1): f"tm_{tm_i}_player" + str(j + 1) for j in range(5)}, axis=1,
-                         inplace=True)
-            gm_df = pd.merge(
-                gm_df,
-                tm_df[["actionNumber"] + [f"tm_{tm_i}_player" + str(j + 1) for j in range(5)]],
-                left_on="actionNumber",
-                right_on="actionNumber",
-                how="left",
-            )
+    if starters is None:
+        if box_df is not None:
+            starters = get_starters(get_starters_df(box_df))
+        else:
+            starters = load_starters_index()
+
+    tm_order = get_game_team_order(df)
+    first_actions = df.groupby("GAME_ID")["actionNumber"].min()
+    pairs_by_tm = {k: v for k, v in get_sub_pairs(df).groupby(["GAME_ID", "teamId"], sort=False)}
+
+    # Only keep games where both teams' starting lineups are known
+    valid_gm_ids = set()
+    for gm_id, gm_tm_order in tm_order.groupby("GAME_ID"):
+        tm_ids = gm_tm_order["teamId"].tolist()
+        if len(tm_ids) < 2:
+            logger.warning(f"Fewer than two teams found in game {gm_id}, skipping.")
+        elif any(len(starters.get((gm_id, tm_id), [])) < 5 for tm_id in tm_ids):
+            logger.warning(f"Starters not found for game {gm_id}, skipping.")
+        else:
+            valid_gm_ids.add(gm_id)
+    df = df[df["GAME_ID"].isin(valid_gm_ids)].reset_index(drop=True)
+    tm_order = tm_order[tm_order["GAME_ID"].isin(valid_gm_ids)]
+    if len(df) == 0:
+        logger.warning("No games with known starters - returning an empty dataframe.")
+        return df.assign(**{f"tm_{tm_i}_player{j + 1}": np.zeros(0, dtype=np.int64) for tm_i in range(2) for j in range(5)})
+
+    # Encode (game, actionNumber) as one sortable integer key
+    gm_codes, gm_uniques = pd.factorize(df["GAME_ID"], sort=True)
+    gm_code_map = {gm_id: i for i, gm_id in enumerate(gm_uniques)}
+    key_scale = int(df["actionNumber"].max()) + 1
+    row_keys = gm_codes.astype(np.int64) * key_scale + df["actionNumber"].values.astype(np.int64)
+
+    for tm_i in range(2):
+        cp_keys = list()
+        cp_lineups = list()
+        for row in tm_order[tm_order["tm_i"] == tm_i].itertuples():
+            key_offset = gm_code_map[row.GAME_ID] * key_scale
+            lineup = starters[(row.GAME_ID, row.teamId)][:5]
+            cp_keys.append(key_offset + int(first_actions[row.GAME_ID]))
+            cp_lineups.append(lineup)
+            if (row.GAME_ID, row.teamId) not in pairs_by_tm:
+                continue
+            for pair in pairs_by_tm[(row.GAME_ID, row.teamId)].itertuples():
+                if pair.personId_out in lineup:
+                    lineup = [pair.personId_in if pl_id == pair.personId_out else pl_id for pl_id in lineup]
+                    cp_keys.append(key_offset + int(pair.actionNumber))
+                    cp_lineups.append(lineup)
+
+        cp_keys = np.array(cp_keys, dtype=np.int64)
+        cp_lineups = np.array(cp_lineups, dtype=np.int64)
+        cp_order = np.argsort(cp_keys, kind="stable")
+        row_cps = cp_order[np.searchsorted(cp_keys[cp_order], row_keys, side="right") - 1]
+        for j in range(5):
+            df[f"tm_{tm_i}_player{j + 1}"] = cp_lineups[row_cps, j]
 
-        for tm_i in range(2):
-            for j in range(5):
-                gm_df[f"tm_{tm_i}_player{j + 1}"] = gm_df[f"tm_{tm_i}_player{j + 1}"].ffill().bfill()
+    return df
 
-        gm_dfs.append(gm_df)
 
-    proc_df = pd.concat(gm_dfs)
-    for pl_c in [c for c in proc_df.columns if "_player" in c]:
-        proc_df[pl_c] = proc_df[pl_c].astype(int)
+def get_elapsed_secs(df):
+    """
+    Get game time elapsed (in seconds) at each PBP action, from the period & game clock (e.g. "PT11M34.00S").
+    Periods 1-4 are 12 minutes long, and overtime periods 5 minutes.
+    :param df: PBP dataframe
+    :return: Array of elapsed seconds
+    """
+    clock_parts = df["clock"].str.extract(r"PT(\d+)M([\d.]+)S").astype(float)
+    clock_secs = (clock_parts[0] * 60 + clock_parts[1]).values
+    period = df["period"].values.astype(int)
+    period_lens = np.where(period <= 4, 720, 300)
+    period_starts = np.where(period <= 4, (period - 1) * 720, 2880 + (period - 5) * 300)
+    return period_starts + period_lens - clock_secs
+
 
-    return proc_df
+def build_stints_df(proc_df):
+    """
+    Split each game into stints - contiguous stretches where a team's five players on court are unchanged -
+    with duration, points for/against and shot counts.
+    Each action is attributed to the lineups on court at that action (see add_pbp_oncourt_columns).
+    :param proc_df: Processed PBP dataframe, with tm_{i}_player{j} columns
+    :return: DataFrame of stints, one row per team-game stint
+    """
+    stint_cols = (["GAME_ID", "teamId", "opp_teamId", "stint_n", "period"] + stint_player_cols
+                  + ["start_time", "end_time"] + stint_stat_cols + ["plus_minus"])
+    df = proc_df.sort_values(["GAME_ID", "actionNumber"]).reset_index(drop=True)
+    if len(df) == 0:
+        return pd.DataFrame(columns=stint_cols)
+
+    tm_order = get_game_team_order(df)
+    row_tm_i = df[["GAME_ID", "teamId"]].merge(tm_order, how="left", on=["GAME_ID", "teamId"])["tm_i"].values
+    gm_codes, gm_uniques = pd.factorize(df["GAME_ID"])
+
+    elapsed = get_elapsed_secs(df)
+    period = df["period"].values.astype(int)
+    period_ends = np.where(period <= 4, period * 720, 2880 + (period - 4) * 300)
+    gm_ends = pd.Series(period_ends).groupby(gm_codes).max().values
+
+    # Per-action scoring & shot counts, for the acting team
+    is_fga = df["actionType"].isin(["2pt", "3pt"]).values
+    is_fg3a = (df["actionType"] == "3pt").values
+    is_fta = (df["actionType"] == "freethrow").values
+    is_made = (df["shotResult"] == "Made").values
+    act_stats = {
+        "pts": np.select([is_fg3a & is_made, is_fga & is_made, is_fta & is_made], [3, 2, 1], 0),
+        "fga": is_fga, "fgm": is_fga & is_made, "fg3a": is_fg3a, "fg3m": is_fg3a & is_made, "fta": is_fta, "ftm": is_fta & is_made
+    }
+
+    tm_ids = tm_order.set_index(["GAME_ID", "tm_i"])["teamId"]
+    stint_dfs = list()
+    for tm_i in range(2):
+        lineups = np.sort(df[[f"tm_{tm_i}_player{j + 1}" for j in range(5)]].values.astype(np.int64), axis=1)
+        new_stint = np.ones(len(df), dtype=bool)
+        new_stint[1:] = (gm_codes[1:] != gm_codes[:-1]) | (lineups[1:] != lineups[:-1]).any(axis=1)
+        stint_ids = np.cumsum(new_stint) - 1
+        start_rows = np.flatnonzero(new_stint)
+        n_stints = len(start_rows)
+
+        stint_gm_codes = gm_codes[start_rows]
+        start_times = elapsed[start_rows]
+        end_times = gm_ends[stint_gm_codes].astype(float)
+        same_gm_next = stint_gm_codes[1:] == stint_gm_codes[:-1]
+        end_times[:-1][same_gm_next] = start_times[1:][same_gm_next]
+
+        stint_gm_ids = gm_uniques[stint_gm_codes]
+        stint_df = pd.DataFrame({
+            "GAME_ID": stint_gm_ids,
+            "teamId": tm_ids.reindex(pd.MultiIndex.from_arrays([stint_gm_ids, np.full(n_stints, tm_i)])).values.astype(np.int64),
+            "opp_teamId": tm_ids.reindex(pd.MultiIndex.from_arrays([stint_gm_ids, np.full(n_stints, 1 - tm_i)])).values.astype(np.int64),
+            "stint_n": pd.Series(stint_gm_codes).groupby(stint_gm_codes).cumcount().values,
+            "period": period[start_rows],
+            **{col: lineups[start_rows, j] for j, col in enumerate(stint_player_cols)},
+            "start_time": start_times,
+            "end_time": end_times,
+            "duration": end_times - start_times,
+        })
+        for side, side_tm_i in [("for", tm_i), ("against", 1 - tm_i)]:
+            side_rows = row_tm_i == side_tm_i
+            for stat, vals in act_stats.items():
+                stint_df[f"{stat}_{side}"] = np.bincount(stint_ids[side_rows], weights=vals[side_rows], minlength=n_stints).astype(int)
+        stint_dfs.append(stint_df)
+
+    stints_df = pd.concat(stint_dfs, ignore_index=True)
+    stints_df = stints_df.assign(plus_minus=stints_df["pts_for"] - stints_df["pts_against"])
+    return stints_df[stint_cols].sort_values(["GAME_ID", "teamId", "stint_n"]).reset_index(drop=True)
+
+
+def load_stints(st_year=None, end_year=None, season_types=None):
+    """
+    Load precomputed stint tables (see build_stints_df)
+    :param st_year: Year to load data from (e.g. 2020 for 2020-21 season)
+    :param end_year: Year to load data to (e.g. 2021 for 2021-22 season)
+    :param season_types: Season types (see def_season_types)
+    :return: DataFrame of stints, with season & season_type columns
+    """
+    if season_types is None:
+        season_types = def_season_types
 
+    if st_year is None:
+        st_year = def_start_year
+    if end_year is None:
+        end_year = curr_season_yr()
 
-def calc_shot_dist_profile(df_in, grp_label, filt_start=0, filt_end=30, filt_width=2, filt_inc=0.25):
+    stint_dfs = list()
+    for yr in range(st_year, end_year + 1):
+        for season_type in season_types:
+            season_suffix = year_to_season_suffix(yr)
+            fpath = os.path.join("data/proc_data", get_fname('stints', season_suffix, season_type))
+            if os.path.exists(fpath):
+                t_df = pd.read_csv(fpath, dtype={"GAME_ID": "str"})
+                stint_dfs.append(t_df.assign(season=season_suffix, season_type=season_type))
+            else:
+                logger.warning(f"File not found at {fpath}")
+    return pd.concat(stint_dfs, ignore_index=True)
+
+
+class StintIndex:
     """
-    :param df_in: PbP log, filtered to include shots only
-    :param grp_label: Give it a group label
+    Query engine over a stints table - aggregates stats for any lineup or player combination.
+    Lineups are held in a bitmask index (see dataproc.LineupIndex), so player filters are vectorized bitwise tests.
+    Player arguments are personIds, as in the tm_{i}_player{j} columns.
+    """
+    def __init__(self, stints_df):
+        import dataproc
+
+        self.stints_df = stints_df.reset_index(drop=True)
+        self.lineup_index = dataproc.LineupIndex.from_df(self.stints_df, player_cols=stint_player_cols)
+        self.stats = self.stints_df[stint_stat_cols].values.astype(float)
+        self.tm_gm_codes = self.stints_df.groupby(["GAME_ID", "teamId"], sort=False).ngroup().values
+        self.team_ids = self.stints_df["teamId"].values
+
+    def get_team_gm_filter(self, players):
+        """
+        Filter of stints in team-games where any of the players was on court at some point
+        :param players: List of personIds
+        :return: Boolean array, one element per stint
+        """
+        players_mask, _ = self.lineup_index.get_players_mask(players)
+        has_players = ((self.lineup_index.lineups & players_mask) != 0).any(axis=1)[self.lineup_index.lineup_idx]
+        tm_gm_filter = np.zeros(self.tm_gm_codes.max() + 1, dtype=bool)
+        tm_gm_filter[self.tm_gm_codes[has_players]] = True
+        return tm_gm_filter[self.tm_gm_codes]
+
+    def get_stint_filter(self, on_players=None, off_players=None, team_id=None):
+        """
+        Filter of stints with all of on_players and none of off_players on court
+        :param on_players: List of personIds that must be on court
+        :param off_players: List of personIds that must be off court
+        :param team_id: Limit to one team's stints. If None and off_players are given,
+            stints are limited to the team-games where any queried player took the court
+        :return: Boolean array, one element per stint
+        """
+        stint_filter = self.lineup_index.get_row_filter(on_players=on_players, off_players=off_players)
+        if team_id is not None:
+            stint_filter &= self.team_ids == team_id
+        elif off_players:
+            stint_filter &= self.get_team_gm_filter(list(on_players or []) + list(off_players))
+        return stint_filter
+
+    def aggregate(self, stint_filter):
+        """
+        Sum stats over the selected stints
+        :param stint_filter: Boolean array, one element per stint
+        :return: Series of summed stats, plus n_stints, plus_minus & per-48 minute points
+        """
+        agg = pd.Series(self.stats[stint_filter].sum(axis=0), index=stint_stat_cols)
+        agg["n_stints"] = int(stint_filter.sum())
+        agg["plus_minus"] = agg["pts_for"] - agg["pts_against"]
+        mins = agg["duration"] / 60
+        agg["pts_for_per48"] = agg["pts_for"] / mins * 48 if mins > 0 else np.nan
+        agg["pts_against_per48"] = agg["pts_against"] / mins * 48 if mins > 0 else np.nan
+        return agg
+
+    def query(self, on_players=None, off_players=None, team_id=None):
+        """
+        Aggregate stats for stints with all of on_players and none of off_players on court
+        :param on_players: List of personIds that must be on court
+        :param off_players: List of personIds that must be off court
+        :param team_id: Limit to one team's stints (see get_stint_filter)
+        :return: Series of aggregated stats
+        """
+        return self.aggregate(self.get_stint_filter(on_players, off_players, team_id))
+
+    def get_on_off(self, players, team_id=None):
+        """
+        On/off stats for a player combination - "on" with all of the players on court, "off" with none of them
+        :param players: List of personIds
+        :param team_id: Limit to one team's stints (see get_stint_filter)
+        :return: DataFrame with "on" and "off" rows
+        """
+        players = list(players)
+        on_filter = self.get_stint_filter(on_players=players, team_id=team_id)
+        off_filter = self.get_stint_filter(off_players=players, team_id=team_id)
+        return pd.DataFrame({"on": self.aggregate(on_filter), "off": self.aggregate(off_filter)}).transpose()
+
+    def get_lineup_stats(self, min_duration=0):
+        """
+        Aggregate stats by team & five-man lineup
+        :param min_duration: Minimum total duration (seconds) for a lineup to be included
+        :return: DataFrame of stats by lineup
+        """
+        stats_df = pd.DataFrame(self.stats, columns=stint_stat_cols)
+        stats_df = stats_df.assign(teamId=self.team_ids, lineup_idx=self.lineup_index.lineup_idx, n_stints=1)
+        lineup_df = stats_df.groupby(["teamId", "lineup_idx"]).sum().reset_index()
+        lineup_df = lineup_df[lineup_df["duration"] >= min_duration]
+        lineup_df = lineup_df.assign(plus_minus=lineup_df["pts_for"] - lineup_df["pts_against"])
+        lineup_df = lineup_df.assign(players=[self.lineup_index.get_lineup_players(i) for i in lineup_df["lineup_idx"]])
+        return lineup_df.sort_values("duration", ascending=False).reset_index(drop=True)
+
+
+def get_shot_dist_windows(filt_start=0, filt_end=30, filt_width=2, filt_inc=0.25):
+    """
+    Get the rolling windows used for shot distance profiles, in output order
     :param filt_start: Shortest distance to analyse - in feet
     :param filt_end: Furthest distance to analyse - in feet
     :param filt_width: Rolling window width for analysis - in feet
     :param filt_inc: Increment for rolling window - in feet
-    :return: 
+    :return: DataFrame with columns shot_type, filt_start, filt_end
     """
-    # Build more granular shot bins
-    ser_list = list()
+    windows = list()
     window_range = 1 + int(((filt_end - filt_start) - filt_width) / filt_inc)
-    window_factor = filt_width / filt_inc
     for i in range(window_range):
         for shot_type in ["2pt", "3pt"]:
             if (shot_type == '2pt' and filt_start <= 22) or (shot_type == '3pt' and filt_start >= 20):
-                filt_df = df_in[
-                    (df_in["shotDistance"] >= filt_start) &
-                    (df_in["shotDistance"] < (filt_start + filt_width)) &
-                    (df_in["actionType"] == shot_type)
-                    ]
-                if len(filt_df) > 0:
-                    ser = pd.Series({"shot_made": filt_df["shot_made"].sum(), "shot_atts": len(filt_df)})
-                    ser["shot_freq"] = ser.shot_atts / len(df_in) / window_factor  # To account for rolling window being wider than increment
-                    ser["shot_acc"] = ser.shot_made / ser.shot_atts
-                    ser["shot_ev"] = ser.shot_made / ser.shot_atts * int(shot_type[0])
-                else:
-                    ser = pd.Series({"shot_made": 0, "shot_atts": 0})
-                    ser["shot_freq"] = 0
-                    ser["shot_acc"] = 0
-                    ser["shot_ev"] = 0
-                ser["group"] = grp_label
-                ser["shot_type"] = shot_type
-                ser["filt_start"] = filt_start
-                ser["filt_end"] = filt_start + filt_width
-                ser["pts_pct"] = int(shot_type[0]) * ser["shot_freq"] * ser["shot_acc"]
-                ser_list.append(ser)
-        filt_start += filt_inc
-    df_out = pd.DataFrame(ser_list)
+                windows.append({"shot_type": shot_type, "filt_start": filt_start, "filt_end": filt_start + filt_width})
+        filt_start += filt_inc  # Accumulated (rather than multiplied) to match window edges from earlier versions
+    return pd.DataFrame(windows, columns=["shot_type", "filt_start", "filt_end"])
+
+
+def calc_grouped_shot_dist_profiles(df_in, grp_col, grp_labels=None, filt_start=0, filt_end=30, filt_width=2, filt_inc=0.25):
+    """
+    Calculate shot profiles by distance for every group in one pass.
+    Shots are binned by the window edges once, and each rolling window's counts
+    are taken as differences of cumulative sums along the edges.
+    :param df_in: PbP log, filtered to include shots only
+    :param grp_col: Column (or list of columns) to group by - e.g. "teamId", "personId", "GAME_ID"
+    :param grp_labels: Dict of group key -> label for the "group" column; group keys are used if None
+    :param filt_start: Shortest distance to analyse - in feet
+    :param filt_end: Furthest distance to analyse - in feet
+    :param filt_width: Rolling window width for analysis - in feet
+    :param filt_inc: Increment for rolling window - in feet
+    :return: Long-format DataFrame of profiles, in order of groups' first appearance; shot_atts_grp is the group size
+    """
+    windows = get_shot_dist_windows(filt_start, filt_end, filt_width, filt_inc)
+    window_factor = filt_width / filt_inc
+    n_windows = len(windows)
+
+    if type(grp_col) == str:
+        grp_codes, grp_keys = pd.factorize(df_in[grp_col], sort=False)
+        grp_keys = list(grp_keys)
+    else:
+        grp_codes, grp_keys = pd.factorize(pd.MultiIndex.from_frame(df_in[list(grp_col)]), sort=False)
+        grp_keys = list(grp_keys)
+    n_grps = len(grp_keys)
+    grp_sizes = np.bincount(grp_codes[grp_codes >= 0], minlength=n_grps)
+
+    shot_made = np.zeros((n_grps, n_windows))
+    shot_atts = np.zeros((n_grps, n_windows))
+    for shot_type in ["2pt", "3pt"]:
+        type_mask = (windows["shot_type"] == shot_type).values
+        edges = np.unique(np.concatenate([windows["filt_start"].values[type_mask], windows["filt_end"].values[type_mask]]))
+
+        row_mask = ((df_in["actionType"] == shot_type).values & (grp_codes >= 0))
+        dists = df_in["shotDistance"].values[row_mask].astype(float)
+        made = df_in["shot_made"].values[row_mask].astype(float)
+        codes = grp_codes[row_mask]
+
+        # Bin k + 1 holds shots in [edges[k], edges[k + 1]); after cumsum, column k counts shots < edges[k]
+        # NaN distances fall in the last bin, so are never counted
+        bin_idx = np.searchsorted(edges, dists, side="right")
+        n_bins = len(edges) + 1
+        flat_idx = codes * n_bins + bin_idx
+        cum_atts = np.bincount(flat_idx, minlength=n_grps * n_bins).reshape(n_grps, n_bins).cumsum(axis=1)
+        cum_made = np.bincount(flat_idx, weights=made, minlength=n_grps * n_bins).reshape(n_grps, n_bins).cumsum(axis=1)
+
+        st_idx = np.searchsorted(edges, windows["filt_start"].values[type_mask])
+        end_idx = np.searchsorted(edges, windows["filt_end"].values[type_mask])
+        shot_atts[:, type_mask] = cum_atts[:, end_idx] - cum_atts[:, st_idx]
+        shot_made[:, type_mask] = cum_made[:, end_idx] - cum_made[:, st_idx]
+
+    shot_pts = windows["shot_type"].str[0].astype(int).values[np.newaxis, :]
+    has_atts = shot_atts > 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        shot_freq = np.where(has_atts, shot_atts / grp_sizes[:, np.newaxis] / window_factor, 0)  # To account for rolling window being wider than increment
+        shot_acc = np.where(has_atts, shot_made / shot_atts, 0)
+        shot_ev = np.where(has_atts, shot_made / shot_atts * shot_pts, 0)
+
+    labels = np.empty(n_grps, dtype=object)  # Filled by element, as group keys may be tuples
+    for i, grp_key in enumerate(grp_keys):
+        labels[i] = grp_key if grp_labels is None else grp_labels[grp_key]
+    df_out = pd.DataFrame({
+        "shot_made": shot_made.ravel(), "shot_atts": shot_atts.ravel(), "shot_freq": shot_freq.ravel(),
+        "shot_acc": shot_acc.ravel(), "shot_ev": shot_ev.ravel(),
+        "group": np.repeat(labels, n_windows),
+        "shot_type": np.tile(windows["shot_type"].values, n_grps),
+        "filt_start": np.tile(windows["filt_start"].values, n_grps),
+        "filt_end": np.tile(windows["filt_end"].values, n_grps),
+        "pts_pct": (shot_pts * shot_freq * shot_acc).ravel(),
+        "shot_atts_grp": np.repeat(grp_sizes, n_windows),
+    })
     return df_out
 
 
+def calc_shot_dist_profile(df_in, grp_label, filt_start=0, filt_end=30, filt_width=2, filt_inc=0.25):
+    """
+    :param df_in: PbP log, filtered to include shots only
+    :param grp_label: Give it a group label
+    :param filt_start: Shortest distance to analyse - in feet
+    :param filt_end: Furthest distance to analyse - in feet
+    :param filt_width: Rolling window width for analysis - in feet
+    :param filt_inc: Increment for rolling window - in feet
+    :return: 
+    """
+    df_out = calc_grouped_shot_dist_profiles(
+        df_in.assign(_grp=0), "_grp", grp_labels={0: grp_label},
+        filt_start=filt_start, filt_end=filt_end, filt_width=filt_width, filt_inc=filt_inc
+    )
+    if len(df_in) == 0:  # No group to profile - return an empty profile
+        df_out = get_shot_dist_windows(filt_start, filt_end, filt_width, filt_inc)
+        for col in ["shot_made", "shot_atts", "shot_freq", "shot_acc", "shot_ev"]:
+            df_out[col] = 0.0
+        df_out = df_out.assign(group=grp_label, pts_pct=0.0)
+    col_order = ["shot_made", "shot_atts", "shot_freq", "shot_acc", "shot_ev", "group", "shot_type", "filt_start", "filt_end", "pts_pct"]
+    return df_out[col_order]
+
+
+def df_fingerprint(df, columns=None):
+    """
+    Get a fingerprint of a DataFrame's contents (ignoring the index), for use in cache keys
+    :param df: DataFrame
+    :param columns: Columns to include; all columns if None
+    :return: Hex digest string
+    """
+    import hashlib
+    if columns is not None:
+        df = df[[c for c in columns if c in df.columns]]
+    row_hashes = pd.util.hash_pandas_object(df, index=False).values
+    hasher = hashlib.sha1(",".join(str(c) for c in df.columns).encode())
+    hasher.update(row_hashes.tobytes())
+    return hasher.hexdigest()[:16]
+
+
+def get_ref_shot_dist_profile(ref_df, season=None, season_type=None, filt_start=0, filt_end=30, filt_width=2, filt_inc=0.25,
+                              persist=False):
+    """
+    Get the reference ("NBA") shot profile by distance, cached in memory (LRU) and optionally on disk.
+    Cache entries are keyed by the season, season type, filter parameters and a fingerprint of the data,
+    so a new entry is calculated whenever the underlying data is updated.
+    :param ref_df: PbP shots log, for use to generate reference data
+    :param season: Season label (e.g. "2021-22") - used to name cache files
+    :param season_type: Season type (see def_season_types) - used to name cache files
+    :param filt_start: Shortest distance to analyse - in feet
+    :param filt_end: Furthest distance to analyse - in feet
+    :param filt_width: Rolling window width for analysis - in feet
+    :param filt_inc: Increment for rolling window - in feet
+    :param persist: Also load from / save to the disk cache (ref_profile_dir). Saving replaces any file
+        for the same season, season type & filter parameters - i.e. from outdated data
+    :return: Reference profile, as per calc_shot_dist_profile
+    """
+    import os
+    filt_params = (filt_start, filt_end, filt_width, filt_inc)
+    fingerprint = df_fingerprint(ref_df, columns=["actionType", "shotDistance", "shot_made"])
+    cache_key = (season, season_type, filt_params, fingerprint)
+    if cache_key in _ref_profile_cache:
+        _ref_profile_cache.move_to_end(cache_key)
+        return _ref_profile_cache[cache_key].copy()
+
+    fname_labels = ["all" if label is None else str(label).replace(" ", "") for label in [season, season_type]]
+    fname_prefix = "_".join(["ref"] + fname_labels + ["-".join(str(p) for p in filt_params)])
+    fpath = os.path.join(ref_profile_dir, f"{fname_prefix}_{fingerprint}.csv")
+    if persist and os.path.exists(fpath):
+        logger.info(f"Loading reference profile from {fpath}")
+        ref_gdf = pd.read_csv(fpath, float_precision="round_trip")
+    else:
+        ref_gdf = calc_shot_dist_profile(ref_df, "NBA", *filt_params)
+        if persist:
+            os.makedirs(ref_profile_dir, exist_ok=True)
+            for old_fname in os.listdir(ref_profile_dir):  # Remove entries for outdated data
+                if old_fname.startswith(fname_prefix + "_"):
+                    os.remove(os.path.join(ref_profile_dir, old_fname))
+            tmp_fpath = fpath + ".tmp"
+            ref_gdf.to_csv(tmp_fpath, index=False)
+            os.replace(tmp_fpath, fpath)
+    _ref_profile_cache[cache_key] = ref_gdf
+    while len(_ref_profile_cache) > ref_profile_cache_size:
+        _ref_profile_cache.popitem(last=False)
+    return ref_gdf.copy()
+
+
+def get_grouped_shot_dist_df(df_in, grp_col, ref_df=None, ref_gdf=None, grp_labels=None, rel_to_total=False, **filt_kwargs):
+    """
+    Get a long-format dataframe of shot profiles by distance for every group, with values relative to a reference.
+    Reference columns are suffixed with _y, and group columns with _x where the two overlap.
+    :param df_in: PbP log, filtered to include shots only
+    :param grp_col: Column (or list of columns) to group by - e.g. "teamId", "personId", "GAME_ID"
+    :param ref_df: PbP shots log, for use to generate reference data; df_in is used if None
+    :param ref_gdf: Precalculated reference profile - overrides ref_df
+    :param grp_labels: Dict of group key -> label for the "group" column; group keys are used if None
+    :param rel_to_total: Express frequencies relative to all shots in df_in, rather than each group's shots (e.g. for players)
+    :param filt_kwargs: Filter parameters for calc_grouped_shot_dist_profiles
+    :return:
+    """
+    if ref_gdf is None:
+        ref_gdf = get_ref_shot_dist_profile(df_in if ref_df is None else ref_df, **filt_kwargs)
+    gdf = calc_grouped_shot_dist_profiles(df_in, grp_col, grp_labels=grp_labels, **filt_kwargs)
+    n_windows = len(get_shot_dist_windows(**filt_kwargs))
+    gdf = gdf.assign(window_idx=np.arange(len(gdf)) % max(n_windows, 1))
+    if rel_to_total:
+        corr_factor = len(df_in) / gdf["shot_atts_grp"]
+        gdf = gdf.assign(shot_freq=gdf["shot_freq"] / corr_factor)
+        gdf = gdf.assign(pts_pct=gdf["pts_pct"] / corr_factor)
+    gdf = gdf.drop(columns="shot_atts_grp")
+
+    # Set relative freqs
+    gdf = gdf.merge(ref_gdf[["shot_type", "filt_start", "shot_freq", "shot_acc", "pts_pct"]], how="left", on=["shot_type", "filt_start"])
+    gdf = gdf[gdf["shot_freq_y"].notna()]
+    gdf = gdf.assign(rel_freq=gdf.shot_freq_x - gdf.shot_freq_y)  # X: Group freq; Y: NBA avg
+    gdf = gdf.assign(rel_acc=gdf.shot_acc_x - gdf.shot_acc_y)  # X: Group acc; Y: NBA avg
+    gdf = gdf.assign(rel_pts=gdf.pts_pct_x - gdf.pts_pct_y)  # X: Group pts; Y: NBA avg
+    gdf = gdf.set_index("window_idx").rename_axis(None)  # Index by window within each group, as per earlier versions
+    return gdf
+
+
 def get_shot_dist_df(df_in, ref_df=None):
     """
     Get a dataframe of shot profiles by distance 
@@ -402,23 +1333,8 @@ def get_shot_dist_df(df_in, ref_df=None):
     :return:
     """
     from nba_api.stats.static import teams
-    if ref_df is None:
-        ref_gdf = calc_shot_dist_profile(df_in, "NBA")
-    else:
-        ref_gdf = calc_shot_dist_profile(ref_df, "NBA")
-    tm_gdfs = list()
-    for tm_id in df_in.teamId.unique():
-        tm_df = df_in[df_in.teamId == tm_id]
-        tm_name = teams.find_team_name_by_id(tm_id)["abbreviation"]
-        tm_gdf = calc_shot_dist_profile(tm_df, tm_name)
-        # Set relative freqs
-        tm_gdf = tm_gdf.merge(ref_gdf[["shot_type", "filt_start", "shot_freq", "shot_acc", "pts_pct"]], how="inner", on=["shot_type", "filt_start"])
-        tm_gdf = tm_gdf.assign(rel_freq=tm_gdf.shot_freq_x - tm_gdf.shot_freq_y)  # X: Team freq; Y: NBA avg
-        tm_gdf = tm_gdf.assign(rel_acc=tm_gdf.shot_acc_x - tm_gdf.shot_acc_y)  # X: Team acc; Y: NBA avg
-        tm_gdf = tm_gdf.assign(rel_pts=tm_gdf.pts_pct_x - tm_gdf.pts_pct_y)  # X: Team pts; Y: NBA avg
-        tm_gdfs.append(tm_gdf)
-
-    gdf_out = pd.concat(tm_gdfs)
+    tm_names = {tm_id: teams.find_team_name_by_id(tm_id)["abbreviation"] for tm_id in df_in.teamId.dropna().unique()}
+    gdf_out = get_grouped_shot_dist_df(df_in, "teamId", ref_df=ref_df, grp_labels=tm_names)
     return gdf_out
 
 
@@ -430,31 +1346,13 @@ def get_pl_shot_dist_df(df_in, ref_df=None):
     :return:
     """
     from nba_api.stats.static import players
-    if ref_df is None:
-        ref_gdf = calc_shot_dist_profile(df_in, "NBA")
-    else:
-        ref_gdf = calc_shot_dist_profile(ref_df, "NBA")
-
-    pl_gdfs = list()
-    for pl_id in df_in.personId.unique():
-        pl_df = df_in[df_in.personId == pl_id]
-        if len(pl_df) > 0:
-            corr_factor = len(df_in) / len(pl_df)
-            try:
-                pl_name = players.find_player_by_id(pl_id)["full_name"]
-            except:
-                pl_name = f"Player {pl_id}"
-            pl_gdf = calc_shot_dist_profile(pl_df, pl_name)
-            pl_gdf = pl_gdf.assign(shot_freq=pl_gdf["shot_freq"] / corr_factor)
-            pl_gdf = pl_gdf.assign(pts_pct=pl_gdf["pts_pct"] / corr_factor)
-            # Set relative freqs
-            pl_gdf = pl_gdf.merge(ref_gdf[["shot_type", "filt_start", "shot_freq", "shot_acc", "pts_pct"]], how="inner", on=["shot_type", "filt_start"])
-            pl_gdf = pl_gdf.assign(rel_freq=pl_gdf.shot_freq_x - pl_gdf.shot_freq_y)  # X: Team freq; Y: NBA avg
-            pl_gdf = pl_gdf.assign(rel_acc=pl_gdf.shot_acc_x - pl_gdf.shot_acc_y)  # X: Team acc; Y: NBA avg
-            pl_gdf = pl_gdf.assign(rel_pts=pl_gdf.pts_pct_x - pl_gdf.pts_pct_y)  # X: Team pts; Y: NBA avg
-            pl_gdfs.append(pl_gdf)
-
-    gdf_out = pd.concat(pl_gdfs)
+    pl_names = dict()
+    for pl_id in df_in.personId.dropna().unique():
+        try:
+            pl_names[pl_id] = players.find_player_by_id(pl_id)["full_name"]
+        except:
+            pl_names[pl_id] = f"Player {pl_id}"
+    gdf_out = get_grouped_shot_dist_df(df_in, "personId", ref_df=ref_df, grp_labels=pl_names, rel_to_total=True)
     return gdf_out
 
 
@@ -507,32 +1405,44 @@ def get_fname(filetype, season_suffix, season_type):
 def add_tm_name_cols(pbp_df):
     """
     Add columns with team name (and opponent name) to PbP DataFrames
-    :param pbp_df:
-    :return:
+    Game IDs are matched as 10-character strings (e.g. '0022100001'): team gamelogs are read with GAME_ID as str,
+    and pbp_df GAME_ID values may be int (e.g. from a CSV read without a dtype) or str - both are normalised
+    with norm_gm_id for the lookup only, so the GAME_ID column of pbp_df is returned unchanged.
+    teamId is matched numerically against the gamelogs' TEAM_ID.
+    :param pbp_df: PbP DataFrame with GAME_ID & teamId columns
+    :return: pbp_df with tm_abv & opp_abv columns (None where the game / team is not in the gamelogs)
     """
     import os
     tm_gamelogs_files = [f for f in os.listdir(dl_dir) if file_prefixes['tm_gamelogs'] in f]
     tmp_dfs = list()
     for fname in tm_gamelogs_files:
         fpath = os.path.join(dl_dir, fname)
-        tmp_df = pd.read_csv(fpath)
+        tmp_df = pd.read_csv(fpath, dtype={"GAME_ID": "str"})
         tmp_dfs.append(tmp_df)
     gamelogs_df = pd.concat(tmp_dfs)
 
-    pbp_df = pbp_df.assign(tm_abv=None)
-    pbp_df = pbp_df.assign(opp_abv=None)
-    for i, row in pbp_df.iterrows():
-        try:
-            tms_found = gamelogs_df[
-                (gamelogs_df.GAME_ID == row["GAME_ID"]) &
-                (gamelogs_df.TEAM_ID == row["teamId"])
-            ]['TEAM_ABBREVIATION']
-            opps_found = gamelogs_df[
-                (gamelogs_df.GAME_ID == row["GAME_ID"]) &
-                (gamelogs_df.TEAM_ID != row["teamId"])
-            ]['TEAM_ABBREVIATION']
-            pbp_df.loc[row.name, 'tm_abv'] = tms_found.values[0]
-            pbp_df.loc[row.name, 'opp_abv'] = opps_found.values[0]
-        except:
-            logger.info(f'Error for row {i} - skipping adding team abv. Game id: {row["GAME_ID"]}; Row id: {row["teamId"]}')
+    # Build a (GAME_ID, TEAM_ID) -> (tm_abv, opp_abv) lookup - opponent is the first other team listed for the game
+    gamelogs_df = gamelogs_df[["GAME_ID", "TEAM_ID", "TEAM_ABBREVIATION"]].reset_index(drop=True)
+    gamelogs_df = gamelogs_df.assign(GAME_ID=gamelogs_df["GAME_ID"].map(norm_gm_id))
+    tm_lookup = gamelogs_df.drop_duplicates(subset=["GAME_ID", "TEAM_ID"])
+    opp_lookup = tm_lookup[["GAME_ID", "TEAM_ID"]].merge(gamelogs_df.reset_index(), on="GAME_ID", suffixes=("", "_opp"))
+    opp_lookup = opp_lookup[opp_lookup["TEAM_ID"] != opp_lookup["TEAM_ID_opp"]]
+    opp_lookup = opp_lookup.sort_values("index", kind="stable").drop_duplicates(subset=["GAME_ID", "TEAM_ID"])
+    abv_lookup = tm_lookup.rename(columns={"TEAM_ABBREVIATION": "tm_abv"}).merge(
+        opp_lookup[["GAME_ID", "TEAM_ID", "TEAM_ABBREVIATION"]].rename(columns={"TEAM_ABBREVIATION": "opp_abv"}),
+        on=["GAME_ID", "TEAM_ID"], how="left"
+    ).rename(columns={"TEAM_ID": "teamId"})
+
+    pbp_df = pbp_df.drop(columns=["tm_abv", "opp_abv"], errors="ignore")
+    gm_codes, gm_ids = pd.factorize(pbp_df["GAME_ID"])  # Normalise each distinct ID once
+    gm_keys = np.array([norm_gm_id(gm_id) for gm_id in gm_ids], dtype=object)[gm_codes]
+    abv_df = pd.DataFrame({"GAME_ID": gm_keys, "teamId": pbp_df["teamId"].values}).merge(
+        abv_lookup, on=["GAME_ID", "teamId"], how="left"
+    )
+    for col in ["tm_abv", "opp_abv"]:
+        pbp_df = pbp_df.assign(**{col: abv_df[col].astype(object).where(abv_df[col].notna(), None).values})
+
+    n_missing = pbp_df["tm_abv"].isna().sum()
+    if n_missing > 0:
+        logger.info(f'Could not find team abv for {n_missing} rows - skipping adding team abv for these')
     return pbp_df
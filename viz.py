@@ -1,8 +1,8 @@
 # ========== (c) JP Hwang 2020-01-10  ==========
 
 import logging
+from collections import OrderedDict
 import dataproc
-import matplotlib.pyplot as plt
 import plotly.graph_objects as go
 import plotly.express as px
 import numpy as np
@@ -11,6 +11,10 @@ import pandas as pd
 # ===== START LOGGER =====
 logger = logging.getLogger(__name__)
 
+league_hexbin_dir = "data/proc_data/league_hexbins"  # Disk cache of league baseline hexbin stats
+league_hexbin_cache_size = 16
+_league_hexbin_cache = OrderedDict()  # LRU of league baseline hexbin stats
+
 
 def fill_def_params(gridsize=None, min_samples=None):
 
@@ -201,53 +205,33 @@ def draw_plotly_court(fig, fig_width=600, mode="dark"):
     return fig
 
 
-def get_hexbin_stats(shots_df, gridsize=None, min_samples=None, min_freqs=2):
+def get_hexbin_stats(shots_df, gridsize=None, min_samples=None, min_freqs=2, smoothing=2.5):
+    """
+    Get shot stats by hexbin
+    :param shots_df: Shots DataFrame
+    :param gridsize: Hexbin grid size
+    :param min_samples: Hexes with fewer shots than this get zero frequency - a fraction of all shots if float
+    :param min_freqs: Minimum value for min_samples when it is a fraction
+    :param smoothing: Neighbourhood size (in hex spacings) for local averaging of accuracies - 1 or less for no smoothing
+    :return:
+    """
 
-    import matplotlib
-    import matplotlib.pyplot as plt
     import numpy as np
-    from dataproc import get_zones
-
-    matplotlib.use('Agg')
+    import hexbins
 
     # TODO - scaling of the hex sizes needs to change for individual players
     # Get parameters
     gridsize, min_samples = fill_def_params(gridsize, min_samples)
+    hex_grid = hexbins.get_hex_grid(gridsize, smoothing=max(smoothing, 1))  # Geometry - built once per gridsize
+
+    hex_idx = hex_grid.get_indices(shots_df.original_x, shots_df.original_y)
+    shots_by_hex = hex_grid.count(hex_idx)
+    makes_by_hex = hex_grid.count(hex_idx[(shots_df.shot_made == 1).values])
 
-    fig, axs = plt.subplots(ncols=2)
-    shots_hex = axs[0].hexbin(
-        shots_df.original_x, shots_df.original_y,
-        extent=(-250, 250, 422.5, -47.5), cmap=plt.cm.Reds, gridsize=gridsize)
-
-    makes_df = shots_df[shots_df.shot_made == 1]
-    makes_hex = axs[0].hexbin(
-        makes_df.original_x, makes_df.original_y,
-        extent=(-250, 250, 422.5, -47.5), cmap=plt.cm.Reds, gridsize=gridsize)
-
-    # assists_df = shots_df[shots_df.assist.notna()]
-    # assists_hex = axs[0].hexbin(
-    #     assists_df.original_x, assists_df.original_y,
-    #     extent=(-250, 250, 422.5, -47.5), cmap=plt.cm.Reds, gridsize=gridsize)
-    # plt.close()
-
-    x = [i[0] for i in shots_hex.get_offsets()]
-    y = [i[1] for i in shots_hex.get_offsets()]
-
-    zones_list = get_zones(x, y)  # Zones list
-
-    shots_by_hex = shots_hex.get_array()
-    shots_by_zones = {i: 0 for i in set(zones_list)}
-    makes_by_hex = makes_hex.get_array()
-    makes_by_zones = {i: 0 for i in set(zones_list)}
-    # assists_by_hex = assists_hex.get_array()
-    # assists_by_zones = {i: 0 for i in set(zones_list)}
-
-    for i in range(len(zones_list)):
-        temp_name = zones_list[i]
-        shots_by_zones[temp_name] += shots_by_hex[i]
-        makes_by_zones[temp_name] += makes_by_hex[i]
-        # assists_by_zones[temp_name] += assists_by_hex[i]
-    accs_by_zones = {k: makes_by_zones[k] / shots_by_zones[k] for k in shots_by_zones.keys()}
+    # assists_by_hex = hex_grid.count(hex_idx[shots_df.assist.notna().values])
+
+    x = hex_grid.xlocs.copy()
+    y = hex_grid.ylocs.copy()
 
     accs_by_hex = np.zeros(len(x))
     # ===== Calculate shot accuracies
@@ -255,139 +239,123 @@ def get_hexbin_stats(shots_df, gridsize=None, min_samples=None, min_freqs=2):
     # accs_by_hex = makes_by_hex/shots_by_hex
     # accs_by_hex[np.isnan(makes_by_hex/shots_by_hex)] = 0
     # # by zones
+    # zones_list = hex_grid.shot_zones  # Zones list
+    # zone_sums = pd.DataFrame({"shots": shots_by_hex, "makes": makes_by_hex}).groupby(np.asarray(zones_list)).sum()
+    # shots_by_zones = zone_sums["shots"].to_dict()
+    # makes_by_zones = zone_sums["makes"].to_dict()
+    # accs_by_zones = (zone_sums["makes"] / zone_sums["shots"]).to_dict()
     # accs_by_hex = np.array([accs_by_zones[zones_list[i]] for i in range(len(zones_list))])
 
-    # by local averaging
-    # get closest points for averaging
-    smoothing = 2.5
-    xy_df = pd.DataFrame([x, y, makes_by_hex, shots_by_hex]).transpose().rename({0: "x", 1: "y", 2: "makes", 3: "shots"}, axis=1)
-    x_spacing = np.sort(xy_df.x.unique())[1] - np.sort(xy_df.x.unique())[0]
-    y_spacing = np.sort(xy_df.y.unique())[1] - np.sort(xy_df.y.unique())[0]
-    len_df = list()
-    if smoothing >= 1:
-        for i in range(len(x)):
-            tmp_x = x[i]
-            tmp_y = y[i]
-            filt_xy_df = xy_df[
-                ((xy_df.x - tmp_x).abs() < (x_spacing * smoothing))
-                & ((xy_df.y - tmp_y).abs() < (y_spacing * smoothing))
-            ]
-            len_df.append(len(filt_xy_df))
-            shots_sum = filt_xy_df.shots.sum()
-            if shots_sum > 0:
-                accs_by_hex[i] = filt_xy_df.makes.sum() / shots_sum
-            else:
-                accs_by_hex[i] = 0
+    # by local averaging - over each hex's (precomputed) neighbourhood
+    if smoothing > 1:
+        accs_by_hex = hexbins.smooth_hex_ratio(makes_by_hex, shots_by_hex, hex_grid.adjacency)
+        len_df = np.diff(hex_grid.nbr_indptr)
         logger.info(f"Smoothing done, max {np.max(len_df)}, min {np.min(len_df)}, mean {np.mean(len_df)}, stdev {np.std(len_df)}")
+    else:
+        has_shots = shots_by_hex > 0
+        accs_by_hex[has_shots] = makes_by_hex[has_shots] / shots_by_hex[has_shots]
 
     # ass_perc_by_zones = {k: assists_by_zones[k] / makes_by_zones[k] for k in makes_by_zones.keys()}
     # ass_perc_by_hex = np.array([ass_perc_by_zones[zones_list[i]] for i in range(len(zones_list))])
 
-    # accs_by_hex = makes_hex.get_array() / shots_hex.get_array()
+    # accs_by_hex = makes_by_hex / shots_by_hex
     accs_by_hex[np.isnan(accs_by_hex)] = 0  # conver NANs to 0
     # ass_perc_by_hex[np.isnan(accs_by_hex)] = 0  # conver NANs to 0
 
     shot_ev_by_hex = accs_by_hex * 2
-    threes_mask = get_threes_mask(gridsize=gridsize)
-    for i in range(len(threes_mask)):
-        if threes_mask[i]:
-            shot_ev_by_hex[i] = shot_ev_by_hex[i] * 1.5
+    shot_ev_by_hex[hex_grid.threes_mask] = shot_ev_by_hex[hex_grid.threes_mask] * 1.5
 
-    shots_by_hex = shots_hex.get_array()
     freq_by_hex = shots_by_hex/sum(shots_by_hex)
 
-    x = [i[0] for i in shots_hex.get_offsets()]
-    y = [i[1] for i in shots_hex.get_offsets()]
-
     # ===== FILTER RESULTS BY SAMPLE SIZE =====
     if min_samples is not None:
         if type(min_samples) == float:
             min_samples = max(int(min_samples * len(shots_df)), min_freqs)
 
-        for i in range(len(shots_by_hex)):
-            if shots_by_hex[i] < min_samples:
-                freq_by_hex[i] = 0
+        freq_by_hex[shots_by_hex < min_samples] = 0
 
     # ===== END FILTER =====
 
-    hexbin_dict = dict()
+    hexbin_stats = hexbins.HexbinStats(
+        xlocs=x, ylocs=y, shots_by_hex=shots_by_hex, freq_by_hex=freq_by_hex,
+        accs_by_hex=accs_by_hex, shot_ev_by_hex=shot_ev_by_hex,
+        gridsize=gridsize, n_shots=len(shots_df)
+    )
 
-    hexbin_dict['xlocs'] = x
-    hexbin_dict['ylocs'] = y
-    hexbin_dict['shots_by_hex'] = shots_by_hex
-    hexbin_dict['freq_by_hex'] = freq_by_hex
-    hexbin_dict['accs_by_hex'] = accs_by_hex
-    # hexbin_dict['ass_perc_by_hex'] = ass_perc_by_hex
-    hexbin_dict['shot_ev_by_hex'] = shot_ev_by_hex
+    return hexbin_stats
 
-    hexbin_dict['gridsize'] = gridsize
-    hexbin_dict['n_shots'] = len(shots_df)
 
-    plt.close()
+def get_league_hexbin_stats(shots_df, gridsize=None, min_samples=None, smoothing=2.5, persist=False):
+    """
+    Get league baseline hexbin stats, memoized (LRU) by a fingerprint of the shots data & the hexbin parameters
+    :param shots_df: Shots DataFrame - all shots for the baseline
+    :param gridsize: Hexbin grid size
+    :param min_samples: As per get_hexbin_stats
+    :param smoothing: As per get_hexbin_stats
+    :param persist: Also load from / save to the disk cache (league_hexbin_dir)
+    :return: HexbinStats (a copy - safe to modify)
+    """
+    import os
+    import utils
+    import hexbins
 
-    return hexbin_dict
+    gridsize, min_samples = fill_def_params(gridsize, min_samples)
+    fingerprint = utils.df_fingerprint(shots_df, columns=["original_x", "original_y", "shot_made"])
+    cache_key = (fingerprint, gridsize, min_samples, smoothing)
+    if cache_key in _league_hexbin_cache:
+        _league_hexbin_cache.move_to_end(cache_key)
+        return _league_hexbin_cache[cache_key].copy()
+
+    fpath = os.path.join(league_hexbin_dir, f"league_hexbins_{gridsize}_{min_samples}_{smoothing}_{fingerprint}.npz")
+    league_hexbin_stats = None
+    if persist and os.path.exists(fpath):
+        try:
+            with np.load(fpath) as npz:
+                league_hexbin_stats = hexbins.HexbinStats(
+                    *[npz[k] for k in hexbins.HexbinStats.array_fields],
+                    **{k: npz[k].tolist() for k in hexbins.HexbinStats.scalar_fields}
+                )
+        except:
+            logger.exception(f"Error loading league hexbin stats from {fpath} - recalculating")
+
+    if league_hexbin_stats is None:
+        league_hexbin_stats = get_hexbin_stats(shots_df, gridsize=gridsize, min_samples=min_samples, smoothing=smoothing)
+        if persist:
+            try:
+                os.makedirs(league_hexbin_dir, exist_ok=True)
+                tmp_fpath = fpath + ".tmp.npz"
+                np.savez(tmp_fpath, **{k: np.asarray(v) for k, v in league_hexbin_stats.items()})
+                os.replace(tmp_fpath, fpath)
+            except:
+                logger.exception(f"Error saving league hexbin stats to {fpath}")
+
+    _league_hexbin_cache[cache_key] = league_hexbin_stats
+    while len(_league_hexbin_cache) > league_hexbin_cache_size:
+        _league_hexbin_cache.popitem(last=False)
+    return league_hexbin_stats.copy()
 
 
 def clip_hexbin_stats(hexbin_stats, temp_key, minval=None, maxval=None):
     """
     Clip hexbin stats to set hexbin values to max/min based on threshold value
-    :param hexbin_stats:
+    :param hexbin_stats: HexbinStats
     :param temp_key:
     :param minval:
     :param maxval:
     :return:
     """
-
-    if minval is not None or maxval is not None:
-        filter_list = list()
-        for i in range(len(hexbin_stats[temp_key])):
-            filter_flag = False
-            if minval is not None and hexbin_stats[temp_key][i] < minval:
-                filter_flag = True
-            if maxval is not None and hexbin_stats[temp_key][i] > maxval:
-                filter_flag = True
-            if filter_flag:
-                filter_list.append(i)
-
-        # for k, v in hexbin_stats.items():
-        #     if type(v) == np.ndarray:
-        #         for i in filter_list:
-        #             v[i] = 0
-        for i in filter_list:
-            hexbin_stats['freq_by_hex'][i] = 0
-
-    else:
-        logger.warning('Nothing is going to be clipped! Check your parameters.')
-
-    return hexbin_stats
+    return hexbin_stats.clip(temp_key, minval=minval, maxval=maxval)
 
 
 def filt_hexbins(hexbin_stats, min_threshold=0.0):
     """
     Filter hexbin stats to exclude hexbin values below a threshold value (of frequency)
 
-    :param hexbin_stats:
+    :param hexbin_stats: HexbinStats
     :param min_threshold:
-    :return:
+    :return: New HexbinStats
     """
-    from copy import deepcopy
-
-    filt_hexbin_stats = deepcopy(hexbin_stats)
-    temp_len = len(filt_hexbin_stats['freq_by_hex'])
-    filt_array = [i > min_threshold for i in filt_hexbin_stats['freq_by_hex']]
-    for k, v in filt_hexbin_stats.items():
-        if type(v) != int:
-            # print(k, len(v), temp_len)
-            if len(v) == temp_len:
-                # print(f'Filtering the {k} array:')
-                filt_hexbin_stats[k] = [v[i] for i in range(temp_len) if filt_array[i]]
-            else:
-                logger.warning(f'WEIRD! The {k} array has a wrong length!')
-        else:
-            pass
-            # print(f'Not filtering {k} as it has an interger value')
-
-    return filt_hexbin_stats
+    return hexbin_stats.filter_by_freq(min_threshold)
 
 
 def mark_hexbin_threes(xlocs, ylocs):
@@ -412,23 +380,9 @@ def mark_hexbin_threes(xlocs, ylocs):
 
 def get_threes_mask(gridsize=51):
 
-    x_coords = list()
-    y_coords = list()
-    for i in range(-250, 250, 5):
-        for j in range(-48, 423, 5):
-            x_coords.append(i)
-            y_coords.append(j)
-
-    fig, axs = plt.subplots(ncols=2)
-    shots_hex = axs[0].hexbin(
-        x_coords, y_coords,
-        extent=(-250, 250, 422.5, -47.5), cmap=plt.cm.Reds, gridsize=gridsize)
-    plt.close()
+    import hexbins
 
-    xlocs = [i[0] for i in shots_hex.get_offsets()]
-    ylocs = [i[1] for i in shots_hex.get_offsets()]
-
-    threes_mask = mark_hexbin_threes(xlocs, ylocs)
+    threes_mask = hexbins.get_hex_grid(gridsize).threes_mask.tolist()
 
     return threes_mask
 
@@ -712,39 +666,29 @@ def clean_chart_format(fig, add_twitter_name=True):
 
 def get_rel_stats(rel_hexbin_stats, base_hexbin_stats, min_threshold):
 
-    rel_hexbin_stats['accs_by_hex'] = rel_hexbin_stats['accs_by_hex'] - base_hexbin_stats['accs_by_hex']
-    rel_hexbin_stats['shot_ev_by_hex'] = rel_hexbin_stats['shot_ev_by_hex'] - base_hexbin_stats['shot_ev_by_hex']
-    rel_hexbin_stats = filt_hexbins(rel_hexbin_stats, min_threshold=min_threshold)
+    rel_hexbin_stats = rel_hexbin_stats.relative_to(base_hexbin_stats).filter_by_freq(min_threshold)
 
     return rel_hexbin_stats
 
 
 def clip_hex_freq(input_freqs, max_freq=0.002):
-    freq_by_hex = np.array([min(max_freq, i) for i in input_freqs])
+    freq_by_hex = np.fmin(np.asarray(input_freqs, dtype=float), max_freq)
     return freq_by_hex
 
 
 def plot_hex_shot_chart(shots_df, teamname, period, stat_type,
                         start_date=None, end_date=None, player=None, on_court_list=None, off_court_list=None,
-                        gridsize=None, min_samples=None, title=None, mode=None, colorscale_in=None):
-
-    from copy import deepcopy
+                        gridsize=None, min_samples=None, title=None, mode=None, colorscale_in=None, persist_baseline=False):
 
     gridsize, min_samples = fill_def_params(gridsize, min_samples)
 
-    league_hexbin_stats = get_hexbin_stats(shots_df, gridsize=gridsize, min_samples=min_samples)
-
     if player == "All":
         player = None
     temp_df = dataproc.filter_shots_df(shots_df, teamname=teamname, period=period, player=player)
 
-    if on_court_list is not None:
-        for on_court in on_court_list:
-            temp_df = temp_df[temp_df["on_court"].str.contains(on_court)]
-
-    if off_court_list is not None:
-        for off_court in off_court_list:
-            temp_df = temp_df[-temp_df["on_court"].str.contains(off_court)]
+    if on_court_list or off_court_list:
+        lineup_index = dataproc.LineupIndex.from_df(temp_df)
+        temp_df = temp_df[lineup_index.get_row_filter(on_players=on_court_list, off_players=off_court_list)]
 
     if start_date is not None:
         temp_df = temp_df[pd.to_datetime(temp_df.date) >= start_date]
@@ -758,16 +702,16 @@ def plot_hex_shot_chart(shots_df, teamname, period, stat_type,
     # PLOT OPTIONS: SHOT ACCURACY (ABSOLUTE OR REL VS AVG FROM ZONE); SHOT PPS - ABSOLUTE, OR VS AVG FROM ZONE)
 
     if stat_type == 'acc_abs':
-        hexbin_stats = filt_hexbins(hexbin_stats, min_samples)
+        hexbin_stats = hexbin_stats.filter_by_freq(min_samples)
 
-        accs_by_hex = hexbin_stats['accs_by_hex']
+        accs_by_hex = hexbin_stats.accs_by_hex
         colorscale = 'YlOrRd'
         marker_cmin = 0.3
         marker_cmax = 0.6
         legend_title = 'Accuracy'
         title_suffix += '<BR>Shot accuracy'
 
-        freq_by_hex = clip_hex_freq(hexbin_stats['freq_by_hex'])
+        freq_by_hex = hexbin_stats.capped_freq()
         hexbin_text = [
             '<i>Accuracy: </i>' + str(round(accs_by_hex[i] * 100, 1)) + '%<BR>'
             for i in range(len(freq_by_hex))
@@ -775,18 +719,17 @@ def plot_hex_shot_chart(shots_df, teamname, period, stat_type,
         ticktexts = [str(marker_cmin * 100) + '%-', "", str(marker_cmax * 100) + '%+']
 
     elif stat_type == 'acc_rel':
-        rel_hexbin_stats = deepcopy(hexbin_stats)
-        base_hexbin_stats = deepcopy(league_hexbin_stats)
-        hexbin_stats = get_rel_stats(rel_hexbin_stats, base_hexbin_stats, min_samples)
+        league_hexbin_stats = get_league_hexbin_stats(shots_df, gridsize=gridsize, min_samples=min_samples, persist=persist_baseline)
+        hexbin_stats = get_rel_stats(hexbin_stats, league_hexbin_stats, min_samples)
 
-        accs_by_hex = hexbin_stats['accs_by_hex']
+        accs_by_hex = hexbin_stats.accs_by_hex
         colorscale = 'RdYlBu_r'
         marker_cmin = -0.1
         marker_cmax = 0.1
         legend_title = 'Accuracy'
         title_suffix += '<BR>Shot accuracy vs NBA average'
 
-        freq_by_hex = clip_hex_freq(hexbin_stats['freq_by_hex'])
+        freq_by_hex = hexbin_stats.capped_freq()
         hexbin_text = [
             '<i>Accuracy: </i>' + str(round(accs_by_hex[i] * 100, 1)) + '%<BR>'
             for i in range(len(freq_by_hex))
@@ -794,9 +737,9 @@ def plot_hex_shot_chart(shots_df, teamname, period, stat_type,
         ticktexts = [str(marker_cmin * 100) + '%-', "", str(marker_cmax * 100) + '%+']
 
     elif stat_type == 'pps_abs':
-        hexbin_stats = filt_hexbins(hexbin_stats, min_samples)
+        hexbin_stats = hexbin_stats.filter_by_freq(min_samples)
 
-        accs_by_hex = hexbin_stats['shot_ev_by_hex']
+        accs_by_hex = hexbin_stats.shot_ev_by_hex
         colorscale = 'RdYlBu_r'
         colorscale = ['DeepPink', '#ffffff', 'LightSkyBlue']
         marker_cmin = 0.75  # 1.048 -> leage avg
@@ -804,7 +747,7 @@ def plot_hex_shot_chart(shots_df, teamname, period, stat_type,
         legend_title = 'PTS/100'
         title_suffix += '<BR>Expected points per 100 shots'
 
-        freq_by_hex = clip_hex_freq(hexbin_stats['freq_by_hex'])
+        freq_by_hex = hexbin_stats.capped_freq()
         hexbin_text = [
             '<i>Point per 100 shots: </i>' + str(round(accs_by_hex[i] * 100, 1))
             for i in range(len(freq_by_hex))
@@ -817,8 +760,8 @@ def plot_hex_shot_chart(shots_df, teamname, period, stat_type,
     #     marker_cmin = 0.848
     #     marker_cmax = 1.248
 
-    xlocs = hexbin_stats['xlocs']
-    ylocs = hexbin_stats['ylocs']
+    xlocs = hexbin_stats.xlocs
+    ylocs = hexbin_stats.ylocs
 
     if title is not None:
         title_txt = title